@@ -1,7 +1,19 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import IntegrityError
+from django.template.response import TemplateResponse
 from .models import Venue
 from .models import MyClubUser
 from .models import Event
+from .models import VenueMonthlyStats
+from .models import NotificationBatch
+from .models import ArchivedEvent
+from .forms import MoveEventsForm, ShiftEventsForm
+from . import bulk
 
 
 # Register your models here.
@@ -12,14 +24,91 @@ admin.site.register(MyClubUser)
 
 @admin.register(Venue)
 class VenueAdmin(admin.ModelAdmin):
-    list_display = ('name', 'address', 'telephone')
+    list_display = ('name', 'address', 'telephone', 'latitude', 'longitude')
     ordering = ('name',)
     search_fields = ('name', 'address',)
 
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
-    fields = (('name', 'venue'), 'event_date', 'description', 'manager')
-    list_display = ('name', 'event_date', 'venue')
-    list_filter = ('event_date', 'venue')
-    ordering = ('event_date',)
\ No newline at end of file
+    fields = (('name', 'venue'), ('event_date', 'end_date'), 'description', 'manager',
+              ('recurrence', 'recurrence_interval'), ('recurrence_until', 'recurrence_count'),
+              'recurrence_exceptions')
+    list_display = ('name', 'event_date', 'venue', 'recurrence')
+    list_filter = ('event_date', 'venue', 'recurrence')
+    ordering = ('event_date',)
+    actions = ('move_events', 'shift_events', 'delete_events')
+
+    def _bulk_action(self, request, queryset, action, form=None):
+        # the changelist posts the selection here first; the intermediate page
+        # posts it back with the form filled in, to preview and then to apply
+        if form is None:
+            form = forms.Form({})
+            submitted = True
+        else:
+            submitted = 'preview' in request.POST or 'apply' in request.POST
+            form = form(request.POST if submitted else None)
+        preview = None
+        if submitted and form.is_valid():
+            options = {
+                'venue': form.cleaned_data.get('venue'),
+                'delta': timedelta(days=form.cleaned_data['days']) if 'days' in form.cleaned_data else None,
+            }
+            try:
+                if 'apply' in request.POST:
+                    result = bulk.apply(request.user, queryset, action, **options)
+                    self.message_user(request, f'{len(result)} events changed.', messages.SUCCESS)
+                    return None
+                preview = bulk.plan(request.user, queryset, action, **options)
+            except PermissionDenied as error:
+                self.message_user(request, str(error), messages.ERROR)
+                return None
+            except ValidationError as error:
+                self.message_user(request, ' '.join(error.messages), messages.ERROR)
+            except IntegrityError:
+                self.message_user(request, 'A venue has just been booked for an overlapping time.', messages.ERROR)
+        return TemplateResponse(request, 'admin/events/event/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': dict(bulk.ACTION_CHOICES)[action],
+            'opts': self.model._meta,
+            'action': f'{action}_events',
+            'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+            'form': form,
+            'preview': preview,
+            'preview_rows': bulk.preview(preview) if preview else [],
+        })
+
+    @admin.action(description='Move selected events to another venue', permissions=['change'])
+    def move_events(self, request, queryset):
+        return self._bulk_action(request, queryset, bulk.MOVE, MoveEventsForm)
+
+    @admin.action(description='Shift the dates of selected events', permissions=['change'])
+    def shift_events(self, request, queryset):
+        return self._bulk_action(request, queryset, bulk.SHIFT, ShiftEventsForm)
+
+    @admin.action(description='Delete selected events in batches', permissions=['delete'])
+    def delete_events(self, request, queryset):
+        return self._bulk_action(request, queryset, bulk.DELETE)
+
+
+@admin.register(VenueMonthlyStats)
+class VenueMonthlyStatsAdmin(admin.ModelAdmin):
+    list_display = ('venue', 'month', 'event_count', 'attendee_count', 'manager_count', 'updated')
+    list_filter = ('month', 'venue')
+    ordering = ('-month', 'venue')
+
+
+@admin.register(NotificationBatch)
+class NotificationBatchAdmin(admin.ModelAdmin):
+    list_display = ('event', 'status', 'attempts', 'created', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('event', 'changes', 'attempts', 'last_error', 'created', 'sent_at')
+
+
+@admin.register(ArchivedEvent)
+class ArchivedEventAdmin(admin.ModelAdmin):
+    list_display = ('name', 'event_date', 'venue', 'archived_at')
+    list_filter = ('venue',)
+    date_hierarchy = 'event_date'
+    ordering = ('-event_date',)
+    search_fields = ('name',)
@@ -0,0 +1,120 @@
+"""Moving past events out of the live ``Event`` table.
+
+``archive_before`` copies events that ended before a cutoff, with their
+attendee links, into ``ArchivedEvent``/``ArchivedAttendance`` and deletes them
+from the live tables, one batch per transaction.  Every ``Event`` query,
+the default manager included, then only touches live rows; the history view
+reads the archive.
+
+On PostgreSQL the archive table can be range partitioned by ``event_date``
+(``EVENT_ARCHIVE_PARTITIONED = True`` when migrating, or ``archive_events
+--partition`` later), with one partition per year created as events are
+archived into it.
+"""
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import DEFAULT_EVENT_DURATION, ArchivedAttendance, ArchivedEvent, Event
+from . import recurrence as rrule
+
+TABLE = ArchivedEvent._meta.db_table
+BATCH_SIZE = 500
+
+
+def _ended_by_count(cutoff):
+    # series bounded by an occurrence count: their last date is not stored, so
+    # the rule is expanded from the cutoff to see whether anything is left
+    series = (
+        Event.objects.exclude(recurrence='')
+        .filter(Q(recurrence_until__isnull=True) | Q(recurrence_until__gte=cutoff),
+                recurrence_count__isnull=False, event_date__lt=cutoff)
+        .only('event_date', 'end_date', 'recurrence', 'recurrence_interval', 'recurrence_until',
+              'recurrence_count', 'recurrence_exceptions')
+    )
+    ended = []
+    for event in series.iterator():
+        duration = (event.end_date or event.event_date + DEFAULT_EVENT_DURATION) - event.event_date
+        dates = rrule.iter_occurrence_dates(
+            event.event_date, event.recurrence, event.recurrence_interval, event.recurrence_until,
+            event.recurrence_count, event.exception_dates(), start=cutoff - duration,
+        )
+        if next(dates, None) is None:
+            ended.append(event.pk)
+    return ended
+
+
+def archivable(cutoff):
+    """archivable(cutoff): Live events that finished before ``cutoff``.  Recurring series are only
+    archivable once their until date has passed too, or their last counted occurrence has
+    finished."""
+    return Event.objects.filter(
+        Q(end_date__lt=cutoff) | Q(end_date__isnull=True, event_date__lt=cutoff),
+        Q(recurrence='') | Q(recurrence_until__lt=cutoff) | Q(pk__in=_ended_by_count(cutoff)),
+    )
+
+
+def archive_before(cutoff, batch_size=BATCH_SIZE):
+    """archive_before(cutoff, batch_size): Moves the archivable events in batches, each in its own
+    transaction, and yields the number of events moved per batch."""
+    fields = [f.attname for f in ArchivedEvent._meta.concrete_fields if f.name != 'archived_at']
+    while True:
+        with transaction.atomic():
+            events = list(archivable(cutoff).select_for_update().order_by('pk')[:batch_size])
+            if not events:
+                return
+            ids = [event.pk for event in events]
+            if is_partitioned():
+                ensure_partitions({event.event_date.year for event in events})
+            ArchivedEvent.objects.bulk_create(
+                [ArchivedEvent(**{name: getattr(event, name) for name in fields}) for event in events])
+            links = Event.attendees.through.objects.filter(event_id__in=ids).values_list('event_id', 'myclubuser_id')
+            ArchivedAttendance.objects.bulk_create(
+                [ArchivedAttendance(event_id=event_id, myclubuser_id=member_id) for event_id, member_id in links],
+                batch_size=1000)
+            Event.objects.filter(pk__in=ids).delete()
+        yield len(events)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def ensure_partitions(years):
+    """ensure_partitions(years): Creates the yearly partitions that do not exist yet.  A year
+    whose rows already sit in the default partition is left there."""
+    with connection.cursor() as cursor:
+        for year in sorted(years):
+            start, end = f'{year}-01-01 00:00:00+00', f'{year + 1}-01-01 00:00:00+00'
+            cursor.execute('SELECT to_regclass(%s)', [f'{TABLE}_y{year}'])
+            if cursor.fetchone()[0] is not None:
+                continue
+            cursor.execute(f'SELECT 1 FROM {TABLE}_default WHERE event_date >= %s AND event_date < %s LIMIT 1',
+                           [start, end])
+            if cursor.fetchone() is not None:
+                continue
+            cursor.execute(f"CREATE TABLE {TABLE}_y{year} PARTITION OF {TABLE} "
+                           f"FOR VALUES FROM ('{start}') TO ('{end}')")
+
+
+def partition_table(schema_editor):
+    """partition_table(schema_editor): Rebuilds the archive table as a table range partitioned by
+    ``event_date``, keeping its rows and indexes.  PostgreSQL only."""
+    old = f'{TABLE}_unpartitioned'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s',
+                       [TABLE, f'{TABLE}_pkey'])
+        indexes = [row[0] for row in cursor.fetchall()]
+    schema_editor.execute(f'ALTER TABLE {TABLE} RENAME TO {old}')
+    schema_editor.execute(f'CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                          f'PARTITION BY RANGE (event_date)')
+    # partitioned tables need the partition key in their primary key
+    schema_editor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, event_date)')
+    schema_editor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+    schema_editor.execute(f'INSERT INTO {TABLE} SELECT * FROM {old}')
+    schema_editor.execute(f'DROP TABLE {old}')
+    for indexdef in indexes:
+        schema_editor.execute(indexdef)
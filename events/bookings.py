@@ -0,0 +1,120 @@
+"""Venue double-booking detection.
+
+``find_conflicts`` runs a sweep over bookings sorted by venue and start time:
+a min-heap holds the bookings still running at the current start, so each
+booking is only compared with the bookings it actually overlaps.  That is
+O(n log n + k) for n bookings and k clashes, instead of comparing every pair.
+
+A recurring series is stored as one row, so it is expanded into one booking
+per occurrence first (``occurrence_bookings``), each as long as the stored
+event.  Open-ended series are expanded up to ``HORIZON`` ahead.  The
+PostgreSQL exclusion constraint only sees the stored first booking of a
+series; clashes with later occurrences are caught by ``Event.clean()`` and
+the ``find_venue_conflicts`` sweep.
+"""
+import heapq
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DEFAULT_EVENT_DURATION, Event
+from . import recurrence as rrule
+
+Booking = namedtuple('Booking', 'id venue_id start end name')
+
+HORIZON = timedelta(days=366)
+# a series that ended this long before a window may still have an occurrence running into it
+MAX_DURATION = timedelta(days=7)
+FIELDS = ('id', 'name', 'venue', 'event_date', 'end_date', 'recurrence', 'recurrence_interval', 'recurrence_until',
+          'recurrence_count', 'recurrence_exceptions')
+
+
+def horizon():
+    return timezone.now() + HORIZON
+
+
+def occurrence_bookings(event, start=None, end=None):
+    """occurrence_bookings(event, start, end): Yields a booking for every occurrence of ``event``
+    overlapping [start, end); ``end`` defaults to ``HORIZON`` ahead for open-ended series."""
+    duration = (event.end_date or event.event_date + DEFAULT_EVENT_DURATION) - event.event_date
+    if not event.recurrence:
+        yield Booking(event.pk, event.venue_id, event.event_date, event.event_date + duration, event.name)
+        return
+    if end is None and event.recurrence_until is None:
+        end = max(horizon(), event.event_date + HORIZON)
+    dates = rrule.iter_occurrence_dates(
+        event.event_date, event.recurrence, event.recurrence_interval, event.recurrence_until,
+        event.recurrence_count, event.exception_dates(), start - duration if start is not None else None, end,
+    )
+    for event_date in dates:
+        yield Booking(event.pk, event.venue_id, event_date, event_date + duration, event.name)
+
+
+def iter_bookings(queryset=None, chunk_size=2000, start=None, end=None):
+    """iter_bookings(queryset, chunk_size, start, end): Streams the venue bookings of ``queryset``
+    sorted by venue and start time, with series expanded into their occurrences."""
+    if queryset is None:
+        queryset = Event.objects.all()
+    events = (
+        queryset.filter(venue__isnull=False)
+        .order_by('venue_id', 'event_date', 'id')
+        .only(*FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    venue_id, bookings = None, []
+    for event in events:
+        if event.venue_id != venue_id:
+            yield from sorted(bookings, key=lambda booking: (booking.start, booking.id))
+            venue_id, bookings = event.venue_id, []
+        bookings.extend(occurrence_bookings(event, start, end))
+    yield from sorted(bookings, key=lambda booking: (booking.start, booking.id))
+
+
+def find_conflicts(bookings):
+    """find_conflicts(bookings): Yields ``(earlier, later)`` pairs of overlapping bookings.
+
+    ``bookings`` must be sorted by venue and start time, as ``iter_bookings`` returns them."""
+    venue_id = None
+    running = []  # heap of (end, id, booking) still open at the current start
+    for booking in bookings:
+        if booking.venue_id != venue_id:
+            venue_id = booking.venue_id
+            running = []
+        while running and running[0][0] <= booking.start:
+            heapq.heappop(running)
+        for _, _, other in running:
+            if other.id != booking.id:
+                yield other, booking
+        heapq.heappush(running, (booking.end, booking.id, booking))
+
+
+def booked_between(venue_ids, start, end):
+    """booked_between(venue_ids, start, end): The events at ``venue_ids`` that can have a booking
+    overlapping [start, end): one-offs that do, and series that have not ended before it."""
+    return Event.objects.filter(
+        Q(recurrence='', event_date__lt=end, end_date__gt=start)
+        | (~Q(recurrence='') & Q(event_date__lt=end)
+           & (Q(recurrence_until__isnull=True) | Q(recurrence_until__gt=start - MAX_DURATION))),
+        venue_id__in=venue_ids,
+    )
+
+
+def conflicts_with(event):
+    """conflicts_with(event): Returns ``(own, other)`` pairs of bookings where an occurrence of
+    ``event`` (saved or not) overlaps another event at its venue."""
+    if event.venue_id is None or event.event_date is None:
+        return []
+    key = event.pk or 0  # unsaved events have no id to tell their bookings apart by
+    own = [booking._replace(id=key) for booking in occurrence_bookings(event)]
+    if not own:
+        return []
+    start, end = own[0].start, max(booking.end for booking in own)
+    others = iter_bookings(booked_between([event.venue_id], start, end).exclude(pk=key), start=start, end=end)
+    bookings = sorted([*own, *others], key=lambda booking: (booking.start, booking.id))
+    return [
+        (earlier, later) if earlier.id == key else (later, earlier)
+        for earlier, later in find_conflicts(bookings)
+        if (earlier.id == key) != (later.id == key)
+    ]
@@ -0,0 +1,245 @@
+"""Bulk changes to the events a member manages.
+
+``plan`` reads the selected events once, with the columns needed to check
+permission, preview the change and look for double bookings, and returns a
+``Plan`` describing every affected row; nothing is written, so it doubles as
+the dry run.  ``apply`` builds the same plan again inside a transaction, with
+the rows locked, and carries it out with ``QuerySet.update()`` (or batched
+deletes) instead of saving event by event.
+
+``update()`` sends no signals, so ``apply`` does what the ``Event`` receivers
+would have done itself: it refreshes the touched stats buckets, purges the
+cached pages, expires the events sitemap and queues attendee notifications.
+Deletes go through ``QuerySet.delete()``, which sends them.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import chain
+
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .bookings import booked_between, find_conflicts, iter_bookings, occurrence_bookings
+from .models import Event, Venue
+from .archive import archivable
+from . import notifications, pagecache, recurrence as rrule, sitemaps, stats
+
+MOVE = 'move'
+SHIFT = 'shift'
+DELETE = 'delete'
+ACTION_CHOICES = [
+    (MOVE, 'Move to another venue'),
+    (SHIFT, 'Shift dates'),
+    (DELETE, 'Delete'),
+]
+
+BATCH_SIZE = 500
+# double bookings listed in a refused plan
+MAX_CONFLICTS = 20
+
+FIELDS = ('id', 'name', 'manager_id', 'venue_id', 'event_date', 'end_date', 'recurrence', 'recurrence_interval',
+          'recurrence_until', 'recurrence_count', 'recurrence_exceptions')
+
+Change = namedtuple('Change', 'before after')
+
+
+class Plan:
+    """The rows a bulk action affects, with their values before and after it."""
+
+    def __init__(self, action, changes, conflicts=(), venue=None, delta=None):
+        self.action = action
+        self.changes = changes
+        self.conflicts = list(conflicts)
+        self.venue = venue
+        self.delta = delta
+
+    def __len__(self):
+        return len(self.changes)
+
+    @property
+    def ids(self):
+        return [change.before['id'] for change in self.changes]
+
+
+def managed_by(user):
+    """managed_by(user): The events ``user`` may change in bulk: all of them for superusers,
+    otherwise the ones they manage."""
+    if user.is_superuser:
+        return Event.objects.all()
+    if not user.is_authenticated:
+        return Event.objects.none()
+    return Event.objects.filter(manager=user)
+
+
+def past_events(user, now=None):
+    """past_events(user, now): The events managed by ``user`` that have already finished, recurring
+    series included once their last occurrence has."""
+    return managed_by(user) & archivable(now or timezone.now())
+
+
+def _shift_exceptions(value, start, delta):
+    # skipped dates name occurrences by their local start date, which moves
+    # with the series
+    dates = rrule.parse_exceptions(value)
+    if not dates:
+        return value
+    tz = timezone.get_current_timezone()
+    at = timezone.localtime(start, tz).time()
+    shifted = (timezone.localtime(timezone.make_aware(datetime.combine(day, at), tz) + delta, tz).date()
+               for day in dates)
+    return ','.join(day.isoformat() for day in sorted(shifted))
+
+
+def _after(row, action, venue, delta):
+    if action == DELETE:
+        return None
+    after = dict(row)
+    if action == MOVE:
+        after['venue_id'] = venue.pk
+    elif action == SHIFT:
+        for field in ('event_date', 'end_date', 'recurrence_until'):
+            if row[field] is not None:
+                after[field] = row[field] + delta
+        after['recurrence_exceptions'] = _shift_exceptions(row['recurrence_exceptions'], row['event_date'], delta)
+    return after
+
+
+def _conflicts(changes):
+    """Double bookings the changed rows would cause, with each other or with the events left alone,
+    comparing every occurrence of a series.  Reads the other bookings at the target venues in one
+    query."""
+    moved = [booking for change in changes if change.after['venue_id'] is not None
+             for booking in occurrence_bookings(Event(**change.after))]
+    if not moved:
+        return []
+    ids = {booking.id for booking in moved}
+    start, end = min(booking.start for booking in moved), max(booking.end for booking in moved)
+    others = iter_bookings(booked_between({booking.venue_id for booking in moved}, start, end), start=start, end=end)
+    bookings = sorted(chain((booking for booking in others if booking.id not in ids), moved),
+                      key=lambda booking: (booking.venue_id, booking.start, booking.id))
+    clashes = []
+    for pair in find_conflicts(bookings):
+        clashes.append(pair)
+        if len(clashes) == MAX_CONFLICTS:
+            break
+    return clashes
+
+
+def plan(user, selection, action, venue=None, delta=None):
+    """plan(user, selection, action, venue, delta): Previews ``action`` on the events of ``selection``
+    without changing anything.
+
+    Raises ``PermissionDenied`` when the selection holds events ``user`` does not manage and
+    ``ValueError`` when the action is missing its venue or delta."""
+    if action == MOVE and venue is None:
+        raise ValueError('Moving events needs a venue.')
+    if action == SHIFT and not delta:
+        raise ValueError('Shifting events needs a non-zero delta.')
+    if action not in dict(ACTION_CHOICES):
+        raise ValueError(f'Unknown bulk action {action!r}.')
+
+    rows = list(selection.order_by('event_date', 'id').values(*FIELDS))
+    if not user.is_superuser:
+        foreign = sum(1 for row in rows if row['manager_id'] != user.pk)
+        if foreign:
+            raise PermissionDenied(f'{foreign} of the selected events are managed by someone else.')
+
+    changes = [Change(row, _after(row, action, venue, delta)) for row in rows]
+    conflicts = _conflicts(changes) if action != DELETE else []
+    return Plan(action, changes, conflicts, venue=venue, delta=delta)
+
+
+def preview(result, limit=None):
+    """preview(result, limit): Rows for showing ``result`` to the user: the event name with its venue
+    and dates before and after the change (``None`` after for deletes)."""
+    changes = result.changes[:limit]
+    venue_ids = {change.before['venue_id'] for change in changes}
+    venue_ids.update(change.after['venue_id'] for change in changes if change.after)
+    venues = dict(Venue.objects.filter(pk__in=venue_ids - {None}).values_list('id', 'name'))
+    rows = []
+    for before, after in changes:
+        rows.append({
+            'id': before['id'],
+            'name': before['name'],
+            'before': (venues.get(before['venue_id']), before['event_date'], before['end_date']),
+            'after': after and (venues.get(after['venue_id']), after['event_date'], after['end_date']),
+        })
+    return rows
+
+
+def _batches(ids, size=BATCH_SIZE):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _after_update(result):
+    ids = result.ids
+    stats.schedule_refresh(*chain.from_iterable(result.changes))
+
+    tags = ['events'] + [pagecache.event_key(pk) for pk in ids]
+    transaction.on_commit(lambda: pagecache.purge(*tags))
+    transaction.on_commit(lambda: sitemaps.bump('events'))
+
+    attended = set()
+    for batch in _batches(ids):
+        attended.update(Event.attendees.through.objects.filter(event_id__in=batch)
+                        .values_list('event_id', flat=True).distinct())
+    for change in result.changes:
+        if change.before['id'] in attended:
+            new = {field: change.after[field] for field in notifications.TRACKED_FIELDS}
+            event = Event(pk=change.before['id'], **new)
+            notifications.enqueue(event, notifications.diff(change.before, event))
+
+
+@contextmanager
+def _overlap_check_deferred():
+    # the PostgreSQL exclusion constraint is checked row by row: shifting
+    # back-to-back bookings would put one on the slot of the next before that
+    # one has moved.  Checked again once every row is updated, still inside
+    # the caller's error handling rather than at an outer commit
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS event_venue_no_overlap DEFERRED')
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS event_venue_no_overlap IMMEDIATE')
+
+
+@transaction.atomic
+def apply(user, selection, action, venue=None, delta=None):
+    """apply(user, selection, action, venue, delta): Carries out ``action`` on the events of
+    ``selection`` in one transaction and returns the plan that was applied.
+
+    Raises ``ValidationError`` instead when the change would double-book a venue."""
+    result = plan(user, selection.select_for_update(), action, venue=venue, delta=delta)
+    if result.conflicts:
+        raise ValidationError('The change would double-book %(count)s venue slots; nothing was changed.',
+                              params={'count': len(result.conflicts)})
+    ids = result.ids
+    if not ids:
+        return result
+
+    if action == DELETE:
+        for batch in _batches(ids):
+            Event.objects.filter(pk__in=batch).delete()
+        return result
+
+    now = timezone.now()
+    if action == MOVE:
+        values = {'venue': venue}
+    else:
+        values = {field: F(field) + delta for field in ('event_date', 'end_date', 'recurrence_until')}
+        exceptions = [Event(pk=change.before['id'], recurrence_exceptions=change.after['recurrence_exceptions'])
+                      for change in result.changes
+                      if change.after['recurrence_exceptions'] != change.before['recurrence_exceptions']]
+        Event.objects.bulk_update(exceptions, ['recurrence_exceptions'], batch_size=BATCH_SIZE)
+    with _overlap_check_deferred():
+        for batch in _batches(ids):
+            Event.objects.filter(pk__in=batch).update(updated=now, **values)
+    _after_update(result)
+    return result
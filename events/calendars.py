@@ -0,0 +1,22 @@
+from calendar import HTMLCalendar
+
+from django.utils.html import format_html, format_html_join
+
+
+class EventCalendar(HTMLCalendar):
+    """Month calendar listing the given occurrences under their day."""
+
+    def __init__(self, occurrences, firstweekday=0):
+        super().__init__(firstweekday)
+        self.by_day = {}
+        for occurrence in occurrences:
+            self.by_day.setdefault(occurrence.event_date.day, []).append(occurrence)
+
+    def formatday(self, day, weekday):
+        if day == 0:
+            return super().formatday(day, weekday)
+        events = format_html_join(
+            '', '<br/><small>{} {}</small>',
+            ((occurrence.event_date.strftime('%H:%M'), occurrence.name) for occurrence in self.by_day.get(day, ())),
+        )
+        return format_html('<td class="{}">{}{}</td>', self.cssclasses[weekday], day, events)
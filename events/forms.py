@@ -1,13 +1,16 @@
+from datetime import timedelta
+
 from django import forms
 from django.forms import ModelForm
 from.models import Venue, Event
+from . import bulk
 
 
 # create a venue forms
 class VenueForm(ModelForm):
     class Meta:
         model = Venue
-        fields = ('name', 'address', 'telephone', 'website', 'email_address', 'venue_image')
+        fields = ('name', 'address', 'telephone', 'website', 'email_address', 'venue_image', 'latitude', 'longitude')
         labels = {
             'name': '',
             'address': '',
@@ -15,6 +18,8 @@ class VenueForm(ModelForm):
             'website': '',
             'email_address': '',
             'venue_image': '',
+            'latitude': '',
+            'longitude': '',
         }
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Venue Name'}),
@@ -22,48 +27,147 @@ class VenueForm(ModelForm):
             'telephone': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Telephone'}),
             'website': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Website'}),
             'email_address': forms.EmailInput(attrs={'class': 'form-control', 'placeholder': 'Email'}),
+            'latitude': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Latitude', 'step': 'any'}),
+            'longitude': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Longitude', 'step': 'any'}),
         }
 
 
+# shared by the event forms: moving the start of an existing event keeps its length
+class BookingForm(ModelForm):
+    def clean(self):
+        cleaned_data = super().clean()
+        event, start = self.instance, cleaned_data.get('event_date')
+        if (event.pk and start and event.event_date and event.end_date
+                and 'event_date' in self.changed_data and 'end_date' not in self.changed_data):
+            cleaned_data['end_date'] = event.end_date + (start - event.event_date)
+        return cleaned_data
+
+
 # admin SuperUser event form
-class EventFormAdmin(ModelForm):
+class EventFormAdmin(BookingForm):
     class Meta:
         model = Event
-        fields = ('name', 'event_date', 'venue', 'manager', 'description', 'attendees')
+        fields = ('name', 'event_date', 'end_date', 'venue', 'manager', 'description', 'attendees',
+                  'recurrence', 'recurrence_interval', 'recurrence_until', 'recurrence_count',
+                  'recurrence_exceptions')
         labels = {
             'name': '',
             'event_date': 'YYYY-MM-DD HH:MM:SS',
+            'end_date': 'Ends (YYYY-MM-DD HH:MM:SS, defaults to two hours later)',
             'venue': 'Venue',
             'manager': 'Manager',
             'description': '',
             'attendees': 'Attendees',
+            'recurrence': 'Repeats',
+            'recurrence_interval': 'Repeat every',
+            'recurrence_until': 'Repeat until (YYYY-MM-DD HH:MM:SS)',
+            'recurrence_count': 'Number of occurrences',
+            'recurrence_exceptions': 'Skipped dates (YYYY-MM-DD, comma separated)',
         }
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Event Name'}),
             'event_date': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Event date'}),
+            'end_date': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'End date'}),
             'venue': forms.Select(attrs={'class': 'form-select', 'placeholder': 'Venue'}),
             'manager': forms.Select(attrs={'class': 'form-select', 'placeholder': 'Manager'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'placeholder': 'Description'}),
-            'attendees': forms.SelectMultiple(attrs={'class': 'form-control', 'placeholder': 'Attendees'})
+            'attendees': forms.SelectMultiple(attrs={'class': 'form-control', 'placeholder': 'Attendees'}),
+            'recurrence': forms.Select(attrs={'class': 'form-select'}),
+            'recurrence_interval': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
+            'recurrence_until': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Repeat until'}),
+            'recurrence_count': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Occurrences'}),
+            'recurrence_exceptions': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Skipped dates'}),
         }
 
 
 # user event form
-class EventForm(ModelForm):
+class EventForm(BookingForm):
     class Meta:
         model = Event
-        fields = ('name', 'event_date', 'venue', 'description', 'attendees')
+        fields = ('name', 'event_date', 'end_date', 'venue', 'description', 'attendees',
+                  'recurrence', 'recurrence_interval', 'recurrence_until', 'recurrence_count',
+                  'recurrence_exceptions')
         labels = {
             'name': '',
             'event_date': 'YYYY-MM-DD HH:MM:SS',
+            'end_date': 'Ends (YYYY-MM-DD HH:MM:SS, defaults to two hours later)',
             'venue': 'Venue',
             'description': '',
             'attendees': 'Attendees',
+            'recurrence': 'Repeats',
+            'recurrence_interval': 'Repeat every',
+            'recurrence_until': 'Repeat until (YYYY-MM-DD HH:MM:SS)',
+            'recurrence_count': 'Number of occurrences',
+            'recurrence_exceptions': 'Skipped dates (YYYY-MM-DD, comma separated)',
         }
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Event Name'}),
             'event_date': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Event date'}),
+            'end_date': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'End date'}),
             'venue': forms.Select(attrs={'class': 'form-select', 'placeholder': 'Venue'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'placeholder': 'Description'}),
-            'attendees': forms.SelectMultiple(attrs={'class': 'form-control', 'placeholder': 'Attendees'})
-        }
\ No newline at end of file
+            'attendees': forms.SelectMultiple(attrs={'class': 'form-control', 'placeholder': 'Attendees'}),
+            'recurrence': forms.Select(attrs={'class': 'form-select'}),
+            'recurrence_interval': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
+            'recurrence_until': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Repeat until'}),
+            'recurrence_count': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Occurrences'}),
+            'recurrence_exceptions': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Skipped dates'}),
+        }
+
+
+# bulk event operations form
+class BulkEventForm(forms.Form):
+    SELECTED = 'selected'
+    PAST = 'past'
+    SCOPE_CHOICES = [
+        (SELECTED, 'The events ticked below'),
+        (PAST, 'All of my past events'),
+    ]
+
+    scope = forms.ChoiceField(label='Events', choices=SCOPE_CHOICES,
+                              widget=forms.Select(attrs={'class': 'form-select'}))
+    action = forms.ChoiceField(label='Action', choices=bulk.ACTION_CHOICES,
+                               widget=forms.Select(attrs={'class': 'form-select'}))
+    venue = forms.ModelChoiceField(label='Move to', queryset=Venue.objects.order_by('name'), required=False,
+                                   widget=forms.Select(attrs={'class': 'form-select'}))
+    days = forms.IntegerField(label='Shift by (days, negative moves earlier)', required=False,
+                              widget=forms.NumberInput(attrs={'class': 'form-control'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        action = cleaned_data.get('action')
+        if action == bulk.MOVE and not cleaned_data.get('venue'):
+            self.add_error('venue', 'Choose the venue to move the events to.')
+        if action == bulk.SHIFT and not cleaned_data.get('days'):
+            self.add_error('days', 'Enter a number of days other than 0.')
+        cleaned_data['events'] = []
+        if cleaned_data.get('scope') == self.SELECTED:
+            try:
+                cleaned_data['events'] = sorted({int(pk) for pk in self.data.getlist('events')})
+            except ValueError:
+                raise forms.ValidationError('The selection is not valid.')
+            if not cleaned_data['events']:
+                raise forms.ValidationError('Tick at least one event.')
+        return cleaned_data
+
+    def options(self):
+        """The keyword arguments for ``bulk.plan``/``bulk.apply``."""
+        action = self.cleaned_data['action']
+        return {
+            'venue': self.cleaned_data['venue'] if action == bulk.MOVE else None,
+            'delta': timedelta(days=self.cleaned_data['days']) if action == bulk.SHIFT else None,
+        }
+
+
+# admin bulk action forms
+class MoveEventsForm(forms.Form):
+    venue = forms.ModelChoiceField(label='Move to', queryset=Venue.objects.order_by('name'))
+
+
+class ShiftEventsForm(forms.Form):
+    days = forms.IntegerField(label='Shift by (days, negative moves earlier)')
+
+    def clean_days(self):
+        if not self.cleaned_data['days']:
+            raise forms.ValidationError('Enter a number of days other than 0.')
+        return self.cleaned_data['days']
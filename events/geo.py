@@ -0,0 +1,144 @@
+"""Geohash encoding and distance helpers for the nearest-venues lookup.
+
+Venues store a geohash of their coordinates in an indexed column.  A radius
+search first turns its bounding box into a handful of geohash cells and asks the
+database for venues whose geohash falls in those cells (plain indexed range
+scans, which SQLite and PostgreSQL both support without PostGIS); only those
+candidates are ranked by haversine distance.
+"""
+import math
+
+from django.db.models import Q
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_LENGTH = 12
+EARTH_RADIUS_KM = 6371.0088
+# upper bound on the cells OR'ed together in one prefilter query
+MAX_CELLS = 16
+
+
+def encode(latitude, longitude, precision=GEOHASH_LENGTH):
+    """encode(latitude, longitude, precision): Returns the geohash of a point."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = bits * 2 + 1
+                lon_range[0] = mid
+            else:
+                bits = bits * 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = bits * 2 + 1
+                lat_range[0] = mid
+            else:
+                bits = bits * 2
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """cell_size(precision): Returns the (height, width) in degrees of a geohash cell."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """haversine_km(lat1, lon1, lat2, lon2): Great-circle distance between two points in km."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """bounding_boxes(latitude, longitude, radius_km): Returns the (min_lat, max_lat, min_lon, max_lon)
+    boxes containing every point within ``radius_km``; two boxes when the circle crosses the
+    180th meridian."""
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(latitude - d_lat, -90.0), min(latitude + d_lat, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    d_lon = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    if d_lon >= 180.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    min_lon, max_lon = longitude - d_lon, longitude + d_lon
+    if min_lon < -180.0:
+        return [(min_lat, max_lat, min_lon + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def _steps(low, high, size):
+    value = low
+    while value < high:
+        yield value
+        value += size
+    yield high
+
+
+def covering_cells(boxes):
+    """covering_cells(boxes): Returns the geohash prefixes, as long as possible while staying
+    under MAX_CELLS, whose cells together cover ``boxes``."""
+    for precision in range(GEOHASH_LENGTH, 0, -1):
+        height, width = cell_size(precision)
+        count = sum(
+            (math.floor((max_lat - min_lat) / height) + 2) * (math.floor((max_lon - min_lon) / width) + 2)
+            for min_lat, max_lat, min_lon, max_lon in boxes
+        )
+        if count > MAX_CELLS and precision > 1:
+            continue
+        cells = set()
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            for lat in _steps(min_lat, max_lat, height):
+                for lon in _steps(min_lon, max_lon, width):
+                    cells.add(encode(lat, lon, precision))
+        return sorted(cells)
+    return []
+
+
+def cells_filter(cells, field='geohash'):
+    """cells_filter(cells, field): Q object matching geohashes inside any of ``cells``, written as
+    range conditions so the column index is used on every database."""
+    query = Q()
+    for cell in cells:
+        # '{' sorts right after 'z', the last geohash character
+        query |= Q(**{f'{field}__gte': cell, f'{field}__lt': cell + '{'})
+    return query
+
+
+def nearest(queryset, latitude, longitude, radius_km, limit=20):
+    """nearest(queryset, latitude, longitude, radius_km, limit): Returns up to ``limit``
+    ``(distance_km, obj)`` pairs within ``radius_km``, closest first.
+
+    Objects need ``latitude``, ``longitude`` and an indexed ``geohash`` field."""
+    boxes = bounding_boxes(latitude, longitude, radius_km)
+    box_filter = Q()
+    for min_lat, max_lat, min_lon, max_lon in boxes:
+        box_filter |= Q(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+    candidates = queryset.filter(cells_filter(covering_cells(boxes))).filter(box_filter)
+
+    results = []
+    for obj in candidates:
+        distance = haversine_km(latitude, longitude, obj.latitude, obj.longitude)
+        if distance <= radius_km:
+            results.append((distance, obj))
+    results.sort(key=lambda result: result[0])
+    return results[:limit]
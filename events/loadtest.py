@@ -0,0 +1,217 @@
+"""Load generator behind the ``loadtest`` management command.
+
+Each worker thread owns a session (its own cookies, so logged-in flows keep
+their session) and fires weighted random routes until the run ends.  Requests
+go either straight into the WSGI application (``WSGISession``) or over HTTP to
+a running server (``HTTPSession``).
+"""
+import io
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.db import connections
+
+THROTTLED = 429
+
+
+class WSGISession:
+    """Calls a WSGI application in-process, keeping cookies between requests."""
+
+    def __init__(self, application, host='localhost', remote_addr='127.0.0.1'):
+        self.application = application
+        self.host = host
+        self.remote_addr = remote_addr
+        self.cookies = {}
+
+    def csrf_token(self):
+        return self.cookies.get(settings.CSRF_COOKIE_NAME, '')
+
+    def request(self, method, path, data=None):
+        path, _, query = path.partition('?')
+        body = urllib.parse.urlencode(data or {}).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host,
+            'REMOTE_ADDR': self.remote_addr,
+            'HTTP_COOKIE': '; '.join(f'{name}={value}' for name, value in self.cookies.items()),
+            'HTTP_X_CSRFTOKEN': self.csrf_token(),
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        result = self.application(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        for name, value in response['headers']:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    self.cookies[morsel.key] = morsel.value
+        return response['status']
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """Sends requests to a running server, without following redirects."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.jar = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar), _NoRedirect)
+
+    def csrf_token(self):
+        for cookie in self.jar:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        return ''
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                         headers={'X-CSRFToken': self.csrf_token()})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class Route:
+    def __init__(self, name, path, weight, method='GET', data=None, login_required=False):
+        self.name = name
+        self.path = path
+        self.weight = weight
+        self.method = method
+        self.data = data
+        self.login_required = login_required
+
+
+def log_in(session, login_path, username, password):
+    """log_in(session, login_path, username, password): Logs the session in through the login form."""
+    session.request('GET', login_path)
+    status = session.request('POST', login_path, {'username': username, 'password': password})
+    if status != 302:
+        raise RuntimeError(f'logging in as {username} failed with status {status}')
+
+
+def percentile(sorted_values, fraction):
+    """percentile(sorted_values, fraction): Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarise(samples):
+    latencies = sorted(latency for _, latency, _ in samples)
+    # 429 is the throttle doing its job, not a failure of the site
+    throttled = sum(1 for _, _, status in samples if status == THROTTLED)
+    errors = sum(1 for _, _, status in samples if status is None or (status >= 400 and status != THROTTLED))
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throttled': throttled,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+
+def run(make_session, routes, concurrency, duration=None, total=None, login=None, seed=None):
+    """run(make_session, routes, concurrency, duration, total, login, seed): Drives ``routes`` from
+    ``concurrency`` threads for ``duration`` seconds or ``total`` requests and returns the report.
+    ``make_session`` is called with the worker's index."""
+    deadline = time.perf_counter() + duration if duration else None
+    budget = {'left': total}
+    lock = threading.Lock()
+
+    def take():
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        if budget['left'] is None:
+            return True
+        with lock:
+            if budget['left'] <= 0:
+                return False
+            budget['left'] -= 1
+            return True
+
+    def worker(index):
+        rng = random.Random(None if seed is None else seed + index)
+        session = make_session(index)
+        samples = []
+        try:
+            if login:
+                log_in(session, *login)
+            else:
+                # POST routes need the CSRF cookie a first page view hands out
+                session.request('GET', next((route.path for route in routes if route.method == 'GET'), '/'))
+            weights = [route.weight for route in routes]
+            while take():
+                route = rng.choices(routes, weights)[0]
+                started = time.perf_counter()
+                try:
+                    status = session.request(route.method, route.path, route.data)
+                except Exception:
+                    status = None
+                samples.append((route.name, time.perf_counter() - started, status))
+        finally:
+            connections.close_all()
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    samples = [sample for result in results for sample in result]
+    report = summarise(samples)
+    report['concurrency'] = concurrency
+    report['seconds'] = round(elapsed, 3)
+    report['throughput_rps'] = round(len(samples) / elapsed, 1) if elapsed else 0.0
+    report['routes'] = {
+        route.name: summarise([sample for sample in samples if sample[0] == route.name]) for route in routes
+    }
+    return report
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from events import archive
+
+
+class Command(BaseCommand):
+    help = 'Moves events that finished before a cutoff, with their attendees, into the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Cutoff date, YYYY-MM-DD.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Archive events that finished more than this many days ago (default 365).')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the events that would move.')
+        parser.add_argument('--partition', action='store_true',
+                            help='Convert the archive table to yearly range partitions first (PostgreSQL).')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                cutoff = timezone.make_aware(datetime.strptime(options['before'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('--before must be a YYYY-MM-DD date.')
+        else:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+
+        if options['partition']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('Partitioning is only available on PostgreSQL.')
+            if not archive.is_partitioned():
+                with connection.schema_editor() as schema_editor:
+                    archive.partition_table(schema_editor)
+                self.stdout.write('Archive table partitioned by event date.')
+
+        if options['dry_run']:
+            count = archive.archivable(cutoff).count()
+            self.stdout.write(f'{count} events finished before {cutoff:%Y-%m-%d} would be archived.')
+            return
+
+        total = 0
+        for moved in archive.archive_before(cutoff, options['batch_size']):
+            total += moved
+            self.stdout.write(f'archived {total} events...')
+        self.stdout.write(self.style.SUCCESS(f'{total} events finished before {cutoff:%Y-%m-%d} archived.'))
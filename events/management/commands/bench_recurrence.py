@@ -0,0 +1,46 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events import recurrence as rrule
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks lazy occurrence expansion of in-memory recurring events over a date window.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', type=int, default=5000, help='Number of recurring series.')
+        parser.add_argument('--days', type=int, default=365, help='Length of the expanded window.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        freqs = [rrule.DAILY, rrule.WEEKLY, rrule.WEEKLY, rrule.MONTHLY]
+        series = []
+        for i in range(options['series']):
+            start = now - timedelta(days=rng.randint(0, 3 * 365), hours=rng.randint(0, 23))
+            series.append(Event(
+                name=f'Series {i}',
+                event_date=start,
+                recurrence=rng.choice(freqs),
+                recurrence_interval=rng.randint(1, 3),
+                recurrence_count=rng.choice([None, None, rng.randint(10, 200)]),
+                recurrence_exceptions=(start + timedelta(days=7 * rng.randint(1, 50))).strftime('%Y-%m-%d'),
+            ))
+        window_start = now
+        window_end = now + timedelta(days=options['days'])
+
+        rrule.occurrence_dates.cache_clear()
+        for label in ('cold', 'memoised'):
+            began = time.perf_counter()
+            total = sum(sum(1 for _ in event.occurrences(window_start, window_end)) for event in series)
+            elapsed = time.perf_counter() - began
+            self.stdout.write(
+                f'{label}: {len(series)} series, {total} occurrences over {options["days"]} days '
+                f'in {elapsed * 1000:.1f} ms ({total / elapsed if elapsed else 0:,.0f} occurrences/s)'
+            )
@@ -0,0 +1,47 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from events import typeahead
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks typeahead lookups against an in-memory prefix index of generated names.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(5000)]
+        items = [
+            (typeahead.VENUE if i % 5 == 0 else typeahead.EVENT, i,
+             ' '.join(rng.choice(words).capitalize() for _ in range(rng.randint(1, 4))))
+            for i in range(options['names'])
+        ]
+
+        began = time.perf_counter()
+        index = typeahead.PrefixIndex.build(items)
+        self.stdout.write(f'built {len(index.keys)} keys for {len(index)} names in '
+                          f'{(time.perf_counter() - began) * 1000:.0f} ms')
+
+        prefixes = [rng.choice(words)[:rng.randint(1, 4)] for _ in range(options['queries'])]
+        timings = []
+        for prefix in prefixes:
+            began = time.perf_counter()
+            index.search(prefix, 10)
+            timings.append(time.perf_counter() - began)
+        timings.sort()
+        self.stdout.write(
+            f'{len(timings)} lookups: p50 {timings[len(timings) // 2] * 1e6:.1f} us, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:.1f} us, max {timings[-1] * 1e6:.1f} us'
+        )
+
+        began = time.perf_counter()
+        for i in range(1000):
+            index.add(typeahead.EVENT, options['names'] + i, f'{rng.choice(words)} night')
+        self.stdout.write(f'1000 inserts: {(time.perf_counter() - began) * 1000:.1f} ms')
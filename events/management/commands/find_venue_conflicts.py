@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from events.bookings import find_conflicts, iter_bookings
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Lists every pair of events booked at the same venue for overlapping times.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--venue', type=int, help='Only check the venue with this id.')
+
+    def handle(self, *args, **options):
+        events = Event.objects.all()
+        if options['venue']:
+            events = events.filter(venue_id=options['venue'])
+
+        count = 0
+        for earlier, later in find_conflicts(iter_bookings(events)):
+            count += 1
+            self.stdout.write(
+                f'venue {later.venue_id}: "{earlier.name}" (#{earlier.id}, {earlier.start:%Y-%m-%d %H:%M}'
+                f' - {earlier.end:%H:%M}) overlaps "{later.name}" (#{later.id}, {later.start:%Y-%m-%d %H:%M}'
+                f' - {later.end:%H:%M})'
+            )
+        if count:
+            self.stdout.write(self.style.WARNING(f'{count} conflicting bookings found.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No conflicting bookings found.'))
@@ -0,0 +1,69 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from events import pagecache
+from events.models import Venue
+
+
+class Command(BaseCommand):
+    help = ('Sets venue coordinates from a CSV file with a header row and the columns '
+            '"id" (or "name"), "latitude" and "longitude".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_file'], newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                if not reader.fieldnames or not {'latitude', 'longitude'} <= set(reader.fieldnames):
+                    raise CommandError('The CSV file needs "latitude" and "longitude" columns.')
+                key = 'id' if 'id' in reader.fieldnames else 'name'
+                if key not in reader.fieldnames:
+                    raise CommandError('The CSV file needs an "id" or a "name" column.')
+
+                updated = skipped = 0
+                batch = []
+                for line, row in enumerate(reader, start=2):
+                    try:
+                        latitude, longitude = float(row['latitude']), float(row['longitude'])
+                    except (TypeError, ValueError):
+                        latitude = longitude = None
+                    if latitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                        self.stderr.write(f'line {line}: invalid coordinates, skipped')
+                        skipped += 1
+                        continue
+                    batch.append((row[key].strip(), latitude, longitude))
+                    if len(batch) >= options['batch_size']:
+                        updated += self._apply(key, batch)
+                        batch = []
+                if batch:
+                    updated += self._apply(key, batch)
+        except OSError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} venues geocoded, {skipped} rows skipped.'))
+
+    def _apply(self, key, batch):
+        values = [value for value, _, _ in batch]
+        if key == 'id':
+            values = [int(value) for value in values if value.isdigit()]
+        venues = {str(getattr(venue, key)): venue for venue in Venue.objects.filter(**{f'{key}__in': values})}
+        changed = []
+        for value, latitude, longitude in batch:
+            venue = venues.get(value)
+            if venue is None:
+                self.stderr.write(f'{key} {value}: no such venue, skipped')
+                continue
+            venue.latitude, venue.longitude = latitude, longitude
+            venue.geohash = venue.compute_geohash()
+            changed.append(venue)
+        with transaction.atomic():
+            Venue.objects.bulk_update(changed, ['latitude', 'longitude', 'geohash'])
+            # bulk_update sends no signals, so purge the cached venue pages here
+            keys = [pagecache.venue_key(venue.pk) for venue in changed]
+            transaction.on_commit(lambda: pagecache.purge(*keys))
+        return len(changed)
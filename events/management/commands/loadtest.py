@@ -0,0 +1,143 @@
+import json
+import threading
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from socketserver import ThreadingMixIn
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from events import loadtest
+from events.models import Venue
+
+# route name -> (weight, method, needs a logged-in user); the default traffic mix
+DEFAULT_MIX = {
+    'home': (4, 'GET', False),
+    'events_list': (3, 'GET', False),
+    'list-venues': (2, 'GET', False),
+    'show-venue': (2, 'GET', False),
+    'venues-near': (1, 'GET', False),
+    'search-venues': (1, 'POST', False),
+    'search_events': (1, 'POST', False),
+    'my_events': (1, 'GET', True),
+    'add-event': (1, 'GET', True),
+}
+
+
+class _ThreadingServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ('Drives a weighted mix of site routes from a thread pool and prints throughput, '
+            'p50/p95/p99 latency, error rate and throttled (429) requests as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run for.')
+        parser.add_argument('--requests', type=int, help='Stop after this many requests instead.')
+        parser.add_argument('--route', action='append', default=[], metavar='NAME=WEIGHT',
+                            help='Route name from the URLconf and its weight; repeat to build the mix.')
+        parser.add_argument('--url', help='Load an already running server at this base URL.')
+        parser.add_argument('--serve', action='store_true',
+                            help='Start the WSGI app on a local HTTP server and load it over sockets.')
+        parser.add_argument('--username', help='Log every worker in through login_user with this user.')
+        parser.add_argument('--password', default='')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+        parser.add_argument('--max-p99-ms', type=float, help='Fail when p99 latency is above this.')
+        parser.add_argument('--max-error-rate', type=float, help='Fail when the error rate is above this.')
+        parser.add_argument('--min-rps', type=float, help='Fail when throughput is below this.')
+
+    def _routes(self, options):
+        mix = DEFAULT_MIX
+        weights = {name: spec[0] for name, spec in mix.items()}
+        if options['route']:
+            weights = {}
+            for item in options['route']:
+                name, _, weight = item.partition('=')
+                try:
+                    weights[name] = float(weight or 1)
+                except ValueError:
+                    raise CommandError(f'Bad weight in --route {item}')
+
+        venue = Venue.objects.order_by('pk').first()
+        routes = []
+        for name, weight in weights.items():
+            _, method, login_required = mix.get(name, (weight, 'GET', False))
+            if login_required and not options['username']:
+                continue
+            args, data = (), None
+            if name == 'show-venue':
+                if venue is None:
+                    continue
+                args = (venue.pk,)
+            try:
+                path = reverse(name, args=args)
+            except Exception:
+                raise CommandError(f'Unknown route {name}')
+            if name == 'venues-near' and venue is not None and venue.latitude is not None:
+                path += f'?lat={venue.latitude}&lon={venue.longitude}&radius=10'
+            if method == 'POST':
+                data = {'searched': venue.name[:3] if venue else 'a'}
+            routes.append(loadtest.Route(name, path, weight, method, data, login_required))
+        if not routes:
+            raise CommandError('No routes to load.')
+        return routes
+
+    def handle(self, *args, **options):
+        routes = self._routes(options)
+        login = None
+        if options['username']:
+            login = (reverse('login'), options['username'], options['password'])
+
+        server = None
+        if options['serve']:
+            from myclub_website.wsgi import application
+            server = make_server('127.0.0.1', 0, application, server_class=_ThreadingServer,
+                                 handler_class=_QuietHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            options['url'] = f'http://localhost:{server.server_port}'
+
+        if options['url']:
+            transport = 'http'
+            make_session = lambda index: loadtest.HTTPSession(options['url'])  # noqa: E731
+        else:
+            from myclub_website.wsgi import application
+            transport = 'wsgi'
+            # one client address per worker, so each gets its own throttle buckets
+            make_session = lambda index: loadtest.WSGISession(  # noqa: E731
+                application, remote_addr=f'127.0.{index // 250}.{index % 250 + 1}')
+
+        try:
+            report = loadtest.run(make_session, routes, options['concurrency'],
+                                  duration=None if options['requests'] else options['duration'],
+                                  total=options['requests'], login=login, seed=options['seed'])
+        except RuntimeError as e:
+            raise CommandError(e)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        report['transport'] = transport
+        report['target'] = options['url'] or 'myclub_website.wsgi.application'
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+        failures = []
+        if options['max_p99_ms'] is not None and report['latency_ms']['p99'] > options['max_p99_ms']:
+            failures.append(f"p99 {report['latency_ms']['p99']} ms > {options['max_p99_ms']} ms")
+        if options['max_error_rate'] is not None and report['error_rate'] > options['max_error_rate']:
+            failures.append(f"error rate {report['error_rate']} > {options['max_error_rate']}")
+        if options['min_rps'] is not None and report['throughput_rps'] < options['min_rps']:
+            failures.append(f"throughput {report['throughput_rps']} rps < {options['min_rps']} rps")
+        if failures:
+            raise CommandError('Load test thresholds failed: ' + '; '.join(failures))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from events import stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the venue monthly stats rollup from the Event table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queued', action='store_true',
+                            help='Only recompute the buckets queued by changes to recurring series.')
+
+    def handle(self, *args, **options):
+        if options['queued']:
+            refreshed = stats.refresh_queued()
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} queued venue stats buckets.'))
+            return
+        written, deleted = stats.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled venue stats: {written} rows written, {deleted} stale rows removed.'
+        ))
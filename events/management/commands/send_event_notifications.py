@@ -0,0 +1,23 @@
+import json
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from events import notifications
+
+
+class Command(BaseCommand):
+    help = 'Mails the queued event change notifications to attendees and reports the throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=notifications.CHUNK_SIZE,
+                            help='Messages handed to the backend per send_messages() call.')
+        parser.add_argument('--limit', type=int, help='Send at most this many batches.')
+        parser.add_argument('--backend', help='Email backend to use instead of settings.EMAIL_BACKEND, '
+                                              'e.g. django.core.mail.backends.filebased.EmailBackend.')
+
+    def handle(self, *args, **options):
+        connection = get_connection(backend=options['backend']) if options['backend'] else None
+        result = notifications.send_pending(connection=connection, chunk_size=options['chunk_size'],
+                                            limit=options['limit'])
+        self.stdout.write(json.dumps(result))
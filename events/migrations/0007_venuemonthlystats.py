@@ -0,0 +1,42 @@
+# Generated by Django 4.2.2 on 2026-10-19 07:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_venue_venue_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VenueMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('event_count', models.PositiveIntegerField(default=0, verbose_name='Events')),
+                ('attendee_count', models.PositiveIntegerField(default=0, verbose_name='Distinct attendees')),
+                ('manager_count', models.PositiveIntegerField(default=0, verbose_name='Distinct managers')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'venue monthly stats',
+                'ordering': ('-month', 'venue'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['venue', 'event_date'], name='event_venue_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='venuemonthlystats',
+            name='venue',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='events.venue'),
+        ),
+        migrations.AddConstraint(
+            model_name='venuemonthlystats',
+            constraint=models.UniqueConstraint(fields=('venue', 'month'), name='unique_venue_month_stats'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.2 on 2026-10-19 07:11
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill_end_dates(apps, schema_editor):
+    Event = apps.get_model('events', 'Event')
+    Event.objects.filter(end_date__isnull=True).update(end_date=models.F('event_date') + timedelta(hours=2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0008_event_recurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='end_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='End Date'),
+        ),
+        migrations.RunPython(backfill_end_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['venue', 'end_date'], name='event_venue_end_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.CheckConstraint(check=models.Q(('end_date__isnull', True), ('end_date__gt', models.F('event_date')), _connector='OR'), name='event_ends_after_start'),
+        ),
+    ]
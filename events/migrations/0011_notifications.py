@@ -0,0 +1,53 @@
+# Generated by Django 4.2.2 on 2026-10-19 07:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0010_venue_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changes', models.JSONField(default=dict, verbose_name='Changed fields')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_batches', to='events.event')),
+            ],
+            options={
+                'ordering': ('created',),
+            },
+        ),
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254)),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='events.notificationbatch')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='notificationdelivery',
+            constraint=models.UniqueConstraint(fields=('batch', 'email'), name='unique_delivery_per_batch'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationbatch',
+            index=models.Index(fields=['status', 'next_attempt'], name='notification_queue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='notificationbatch',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('event',), name='one_pending_batch_per_event'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.2 on 2026-10-19 07:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def partition_archive(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql' and getattr(settings, 'EVENT_ARCHIVE_PARTITIONED', False):
+        from events.archive import partition_table
+        partition_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('events', '0011_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedEvent',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=120, verbose_name='Event Name')),
+                ('event_date', models.DateTimeField(verbose_name='Event Date')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='End Date')),
+                ('description', models.TextField(blank=True)),
+                ('recurrence', models.CharField(blank=True, choices=[('', 'Does not repeat'), ('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], default='', max_length=7, verbose_name='Repeats')),
+                ('recurrence_interval', models.PositiveSmallIntegerField(default=1, verbose_name='Repeat every')),
+                ('recurrence_until', models.DateTimeField(blank=True, null=True, verbose_name='Repeat until')),
+                ('recurrence_count', models.PositiveIntegerField(blank=True, null=True, verbose_name='Number of occurrences')),
+                ('recurrence_exceptions', models.TextField(blank=True, verbose_name='Skipped dates')),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('attendees', models.ManyToManyField(blank=True, through='events.ArchivedAttendance', to='events.myclubuser')),
+                ('manager', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('venue', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='events.venue')),
+            ],
+            options={
+                'ordering': ('-event_date',),
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedattendance',
+            name='event',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='events.archivedevent'),
+        ),
+        migrations.AddField(
+            model_name='archivedattendance',
+            name='myclubuser',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='events.myclubuser'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedevent',
+            index=models.Index(fields=['venue', 'event_date'], name='archived_venue_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedevent',
+            index=models.Index(fields=['event_date'], name='archived_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedattendance',
+            constraint=models.UniqueConstraint(fields=('event', 'myclubuser'), name='unique_archived_attendance'),
+        ),
+        migrations.RunPython(partition_archive, migrations.RunPython.noop),
+    ]
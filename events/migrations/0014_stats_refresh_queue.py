@@ -0,0 +1,31 @@
+# Generated by Django 4.2.2 on 2026-10-19 07:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0013_updated_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('queued', models.DateTimeField(default=django.utils.timezone.now)),
+                ('venue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='events.venue')),
+            ],
+            options={
+                'ordering': ('queued',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='statsrefresh',
+            constraint=models.UniqueConstraint(fields=('venue', 'month'), name='unique_venue_month_refresh'),
+        ),
+    ]
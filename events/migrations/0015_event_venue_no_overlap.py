@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# clashing pairs listed when the constraint cannot be added
+MAX_LISTED = 20
+
+
+def add_booking_exclusion(apps, schema_editor):
+    # PostgreSQL enforces non-overlapping bookings itself; other databases rely
+    # on Event.clean() and the indexed overlap query.  The constraint only sees
+    # the stored first booking of a recurring series; its later occurrences
+    # are checked by Event.clean() and find_venue_conflicts.  It is added
+    # apart from 0009, so end_date exists and the clashes its backfill may
+    # have produced can be listed and fixed before migrating further
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT a.venue_id, a.id, a.name, b.id, b.name FROM events_event a JOIN events_event b"
+            " ON a.venue_id = b.venue_id AND a.id < b.id"
+            " AND tstzrange(a.event_date, COALESCE(a.end_date, a.event_date), '[)')"
+            " && tstzrange(b.event_date, COALESCE(b.end_date, b.event_date), '[)')"
+            " ORDER BY a.venue_id, a.event_date, a.id LIMIT %s",
+            [MAX_LISTED + 1],
+        )
+        clashes = cursor.fetchall()
+    if clashes:
+        lines = [f'  venue {venue_id}: "{name}" (#{pk}) overlaps "{other_name}" (#{other_pk})'
+                 for venue_id, pk, name, other_pk, other_name in clashes[:MAX_LISTED]]
+        if len(clashes) > MAX_LISTED:
+            lines.append('  ...')
+        raise RuntimeError(
+            'Some venues are double-booked, so event_venue_no_overlap cannot be added:\n'
+            + '\n'.join(lines)
+            + '\nMove or shorten these events (end_date was backfilled to two hours after the start;'
+            ' "manage.py find_venue_conflicts" lists every clash) and run migrate again.'
+        )
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        "ALTER TABLE events_event ADD CONSTRAINT event_venue_no_overlap EXCLUDE USING gist ("
+        " venue_id WITH =,"
+        " tstzrange(event_date, COALESCE(end_date, event_date), '[)') WITH &&"
+        ") WHERE (venue_id IS NOT NULL)"
+        # deferrable, so bulk.apply can check it once all its rows have moved
+        " DEFERRABLE INITIALLY IMMEDIATE"
+    )
+
+
+def remove_booking_exclusion(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE events_event DROP CONSTRAINT IF EXISTS event_venue_no_overlap')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0014_stats_refresh_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_booking_exclusion, remove_booking_exclusion),
+    ]
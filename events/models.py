@@ -1,8 +1,19 @@
+from datetime import timedelta
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
+
+from . import geo
+from . import recurrence as rrule
 
 # Create your models here.
 
+# length of a booking when an event is saved without an end date
+DEFAULT_EVENT_DURATION = timedelta(hours=2)
+
 
 class Venue(models.Model):
     name = models.CharField('Venue Name', max_length=120)
@@ -12,10 +23,25 @@ class Venue(models.Model):
     email_address = models.EmailField('Email address', blank=True)
     owner = models.IntegerField("Venue Owner", blank=False, default=1)
     venue_image = models.ImageField(null=True, blank=True, upload_to="images/")
+    latitude = models.FloatField('Latitude', null=True, blank=True,
+                                 validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField('Longitude', null=True, blank=True,
+                                  validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    geohash = models.CharField(max_length=geo.GEOHASH_LENGTH, blank=True, db_index=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.geohash = self.compute_geohash()
+        super().save(*args, **kwargs)
+
+    def compute_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            return ''
+        return geo.encode(self.latitude, self.longitude)
+
 
 class MyClubUser(models.Model):
     first_name = models.CharField(max_length=30)
@@ -29,13 +55,207 @@ class MyClubUser(models.Model):
 class Event(models.Model):
     name = models.CharField('Event Name', max_length=120)
     event_date = models.DateTimeField('Event Date')
+    end_date = models.DateTimeField('End Date', blank=True, null=True)
     venue = models.ForeignKey(Venue, blank=True, null=True, on_delete=models.CASCADE)
     # venue = models.CharField(max_length=120)
     manager = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
     description = models.TextField(blank=True)
     attendees = models.ManyToManyField(MyClubUser, blank=True)
+    recurrence = models.CharField('Repeats', max_length=7, choices=rrule.FREQUENCY_CHOICES, blank=True, default='')
+    recurrence_interval = models.PositiveSmallIntegerField('Repeat every', default=1)
+    recurrence_until = models.DateTimeField('Repeat until', blank=True, null=True)
+    recurrence_count = models.PositiveIntegerField('Number of occurrences', blank=True, null=True)
+    recurrence_exceptions = models.TextField('Skipped dates', blank=True,
+                                             help_text='YYYY-MM-DD dates, comma separated')
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['venue', 'event_date'], name='event_venue_date_idx'),
+            models.Index(fields=['venue', 'end_date'], name='event_venue_end_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(end_date__isnull=True) | models.Q(end_date__gt=models.F('event_date')),
+                                   name='event_ends_after_start'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.end_date is None and self.event_date is not None:
+            self.end_date = self.event_date + DEFAULT_EVENT_DURATION
+        super().save(*args, **kwargs)
+
+    def clean(self):
+        if self.recurrence_interval is not None and self.recurrence_interval < 1:
+            raise ValidationError({'recurrence_interval': 'The interval must be at least 1.'})
+        try:
+            rrule.parse_exceptions(self.recurrence_exceptions)
+        except ValueError:
+            raise ValidationError({'recurrence_exceptions': 'Use YYYY-MM-DD dates separated by commas.'})
+        if self.event_date is None:
+            return
+        if self.end_date is not None and self.end_date <= self.event_date:
+            raise ValidationError({'end_date': 'The event must end after it starts.'})
+        clashes = list(self.conflicting_events().values_list('name', flat=True).order_by('event_date')[:5])
+        if clashes:
+            raise ValidationError('%(venue)s is already booked at that time by: %(events)s.',
+                                  params={'venue': self.venue, 'events': ', '.join(clashes)})
+
+    @property
+    def ends_at(self):
+        return self.end_date or self.event_date + DEFAULT_EVENT_DURATION
+
+    def conflicting_events(self):
+        """Returns the other events booked at the same venue for an overlapping time, comparing
+        every occurrence of recurring events."""
+        from .bookings import conflicts_with
+        return Event.objects.filter(pk__in={other.id for _, other in conflicts_with(self)})
+
+    @property
+    def is_recurring(self):
+        return bool(self.recurrence)
+
+    def exception_dates(self):
+        try:
+            return rrule.parse_exceptions(self.recurrence_exceptions)
+        except ValueError:
+            return frozenset()
+
+    def occurrences(self, start, end):
+        """Yields the occurrences of this event in [start, end) without touching the database."""
+        return rrule.expand(self, start, end)
+
+
+class VenueMonthlyStats(models.Model):
+    venue = models.ForeignKey(Venue, on_delete=models.CASCADE, related_name='monthly_stats')
+    month = models.DateField('Month')
+    event_count = models.PositiveIntegerField('Events', default=0)
+    attendee_count = models.PositiveIntegerField('Distinct attendees', default=0)
+    manager_count = models.PositiveIntegerField('Distinct managers', default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'venue monthly stats'
+        ordering = ('-month', 'venue')
+        constraints = [
+            models.UniqueConstraint(fields=('venue', 'month'), name='unique_venue_month_stats'),
+        ]
+
+    def __str__(self):
+        return f'{self.venue} {self.month:%B %Y}'
+
+
+class StatsRefresh(models.Model):
+    # a venue/month rollup bucket waiting for stats.refresh_queued()
+    venue = models.ForeignKey(Venue, on_delete=models.CASCADE, related_name='+')
+    month = models.DateField('Month')
+    queued = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ('queued',)
+        constraints = [
+            models.UniqueConstraint(fields=('venue', 'month'), name='unique_venue_month_refresh'),
+        ]
+
+    def __str__(self):
+        return f'{self.venue} {self.month:%B %Y}'
+
+
+class NotificationBatch(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
 
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='notification_batches')
+    changes = models.JSONField('Changed fields', default=dict)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('created',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='notification_queue_idx'),
+        ]
+        constraints = [
+            # later changes are merged into the waiting batch instead of queueing another
+            models.UniqueConstraint(fields=['event'], condition=models.Q(status='pending'),
+                                    name='one_pending_batch_per_event'),
+        ]
+
+    def __str__(self):
+        return f'{self.event} ({self.get_status_display()})'
+
+
+class NotificationDelivery(models.Model):
+    batch = models.ForeignKey(NotificationBatch, on_delete=models.CASCADE, related_name='deliveries')
+    email = models.EmailField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'email'], name='unique_delivery_per_batch'),
+        ]
+
+    def __str__(self):
+        return self.email
+
+
+class ArchivedEvent(models.Model):
+    # keeps the id the event had while it was live
+    id = models.BigIntegerField(primary_key=True)
+    name = models.CharField('Event Name', max_length=120)
+    event_date = models.DateTimeField('Event Date')
+    end_date = models.DateTimeField('End Date', blank=True, null=True)
+    # no database constraints, so the table can be range partitioned on PostgreSQL
+    venue = models.ForeignKey(Venue, blank=True, null=True, on_delete=models.CASCADE, db_constraint=False)
+    manager = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL, db_constraint=False)
+    description = models.TextField(blank=True)
+    attendees = models.ManyToManyField(MyClubUser, blank=True, through='ArchivedAttendance')
+    recurrence = models.CharField('Repeats', max_length=7, choices=rrule.FREQUENCY_CHOICES, blank=True, default='')
+    recurrence_interval = models.PositiveSmallIntegerField('Repeat every', default=1)
+    recurrence_until = models.DateTimeField('Repeat until', blank=True, null=True)
+    recurrence_count = models.PositiveIntegerField('Number of occurrences', blank=True, null=True)
+    recurrence_exceptions = models.TextField('Skipped dates', blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-event_date',)
+        indexes = [
+            models.Index(fields=['venue', 'event_date'], name='archived_venue_date_idx'),
+            models.Index(fields=['event_date'], name='archived_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def exception_dates(self):
+        try:
+            return rrule.parse_exceptions(self.recurrence_exceptions)
+        except ValueError:
+            return frozenset()
+
+
+class ArchivedAttendance(models.Model):
+    event = models.ForeignKey(ArchivedEvent, on_delete=models.CASCADE, db_constraint=False)
+    myclubuser = models.ForeignKey(MyClubUser, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'myclubuser'], name='unique_archived_attendance'),
+        ]
+
+    def __str__(self):
+        return f'{self.myclubuser} at {self.event}'
@@ -0,0 +1,197 @@
+"""Attendee notifications for changed events.
+
+Saving an event whose date or venue changed queues one ``NotificationBatch``
+for it (further changes are merged into the waiting batch).  Nothing is sent
+during the request: ``send_pending`` (run by the ``send_event_notifications``
+command) delivers the queued batches through a single reused email connection,
+remembering the delivered addresses a chunk at a time so a retried batch never
+mails anyone twice.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Event, NotificationBatch, NotificationDelivery, Venue
+
+TRACKED_FIELDS = ('event_date', 'end_date', 'venue_id')
+
+CHUNK_SIZE = getattr(settings, 'NOTIFICATION_CHUNK_SIZE', 100)
+MAX_ATTEMPTS = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+# a batch claimed by a worker that died is picked up again after this
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def _serialise(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def diff(previous, event):
+    """diff(previous, event): Returns ``{field: {'old': ..., 'new': ...}}`` for the tracked fields
+    that differ between the stored ``previous`` values and ``event``."""
+    changes = {}
+    for field in TRACKED_FIELDS:
+        old, new = previous.get(field), getattr(event, field)
+        if old != new:
+            changes[field] = {'old': _serialise(old), 'new': _serialise(new)}
+    return changes
+
+
+def enqueue(event, changes):
+    """enqueue(event, changes): Queues the changes of ``event`` for its attendees, merging them
+    into the batch already waiting for this event, if any."""
+    if not changes:
+        return None
+    try:
+        with transaction.atomic():
+            batch, created = NotificationBatch.objects.select_for_update().get_or_create(
+                event=event, status=NotificationBatch.PENDING, defaults={'changes': changes})
+    except IntegrityError:
+        # another request queued the batch between our lookup and insert
+        batch, created = NotificationBatch.objects.get(event=event, status=NotificationBatch.PENDING), False
+    if created:
+        return batch
+
+    merged = dict(batch.changes)
+    for field, change in changes.items():
+        old = merged.get(field, change)['old']
+        if old == change['new']:
+            merged.pop(field, None)  # changed back, nothing to tell
+        else:
+            merged[field] = {'old': old, 'new': change['new']}
+    if merged:
+        batch.changes = merged
+        batch.save(update_fields=['changes'])
+        return batch
+    batch.delete()
+    return None
+
+
+def _describe(field, value):
+    if value is None:
+        return 'not set'
+    if field == 'venue_id':
+        venue = Venue.objects.filter(pk=value).first()
+        return str(venue) if venue else 'a venue that no longer exists'
+    return timezone.localtime(parse_datetime(value)).strftime('%A %d %B %Y, %H:%M')
+
+
+LABELS = {'event_date': 'Date', 'end_date': 'Ends', 'venue_id': 'Venue'}
+
+
+def render_message(event, changes):
+    """render_message(event, changes): Returns the subject and body of the mail for a batch."""
+    lines = [f'The details of "{event}" have changed:', '']
+    for field in TRACKED_FIELDS:
+        if field in changes:
+            change = changes[field]
+            lines.append(f'{LABELS[field]}: {_describe(field, change["old"])} -> {_describe(field, change["new"])}')
+    return f'Change to {event}', '\n'.join(lines) + '\n'
+
+
+def _claim(batch):
+    now = timezone.now()
+    return NotificationBatch.objects.filter(pk=batch.pk, status=batch.status, next_attempt__lte=now).update(
+        status=NotificationBatch.SENDING, next_attempt=now + CLAIM_TIMEOUT) == 1
+
+
+def _recipients(batch):
+    emails = Event.attendees.through.objects.filter(event_id=batch.event_id).values_list('myclubuser__email', flat=True)
+    delivered = set(batch.deliveries.values_list('email', flat=True))
+    # one mail per address, however many member records share it
+    return sorted({email.strip().lower() for email in emails if email} - delivered)
+
+
+def _send_chunk(connection, messages, delivered):
+    # messages go out one by one so a failure is known to have hit the message
+    # it was raised for: the ones before it were delivered (and are appended to
+    # ``delivered``) and must not be sent again.  Most failures are a dropped
+    # SMTP connection, so the chunk reconnects once and resumes there
+    retried = False
+    for message in messages:
+        while True:
+            try:
+                connection.send_messages([message])
+                break
+            except Exception:
+                if retried:
+                    raise
+                retried = True
+                connection.close()
+                connection.open()
+        delivered.append(message.to[0])
+
+
+def send_batch(batch, connection, chunk_size=CHUNK_SIZE):
+    """send_batch(batch, connection, chunk_size): Mails the batch to every attendee not yet
+    reached and returns the number of messages sent."""
+    subject, body = render_message(batch.event, batch.changes)
+    recipients = _recipients(batch)
+    sent = 0
+    for i in range(0, len(recipients), chunk_size):
+        chunk = recipients[i:i + chunk_size]
+        messages = [EmailMessage(subject, body, to=[email], connection=connection) for email in chunk]
+        delivered = []
+        try:
+            _send_chunk(connection, messages, delivered)
+        finally:
+            NotificationDelivery.objects.bulk_create(
+                [NotificationDelivery(batch=batch, email=email) for email in delivered], ignore_conflicts=True)
+        sent += len(delivered)
+    return sent
+
+
+def send_pending(connection=None, chunk_size=CHUNK_SIZE, max_attempts=MAX_ATTEMPTS, limit=None):
+    """send_pending(connection, chunk_size, max_attempts, limit): Sends the queued batches that are
+    due and returns a dict with the batch and message counts and the throughput."""
+    connection = connection or get_connection()
+    now = timezone.now()
+    due = (
+        NotificationBatch.objects.filter(
+            status__in=(NotificationBatch.PENDING, NotificationBatch.SENDING), next_attempt__lte=now)
+        .select_related('event')
+        .order_by('next_attempt')
+    )
+    if limit:
+        due = due[:limit]
+
+    result = {'batches': 0, 'failed': 0, 'messages': 0}
+    started = time.perf_counter()
+    connection.open()
+    try:
+        for batch in due:
+            if not _claim(batch):
+                continue
+            try:
+                result['messages'] += send_batch(batch, connection, chunk_size)
+            except Exception as e:
+                batch.attempts += 1
+                batch.last_error = repr(e)
+                if batch.attempts >= max_attempts:
+                    batch.status = NotificationBatch.FAILED
+                    result['failed'] += 1
+                else:
+                    batch.status = NotificationBatch.PENDING
+                    batch.next_attempt = timezone.now() + timedelta(minutes=2 ** batch.attempts)
+                try:
+                    batch.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt'])
+                except IntegrityError:
+                    # a newer change was queued meanwhile; it will carry the news
+                    batch.status = NotificationBatch.FAILED
+                    batch.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt'])
+                continue
+            batch.status = NotificationBatch.SENT
+            batch.sent_at = timezone.now()
+            batch.save(update_fields=['status', 'sent_at'])
+            result['batches'] += 1
+    finally:
+        connection.close()
+
+    elapsed = time.perf_counter() - started
+    result['seconds'] = round(elapsed, 3)
+    result['messages_per_second'] = round(result['messages'] / elapsed, 1) if elapsed else 0.0
+    return result
@@ -0,0 +1,183 @@
+"""Full-page cache for anonymous visitors with surrogate-key invalidation.
+
+Logged-out visitors all get the same HTML, so ``cache_anonymous_page`` stores the
+rendered response keyed on path and query string.  Views tag their response
+with the ids it was built from (``add_surrogate_keys``); every tag has a version
+number in the cache, and a page is only served while the versions it was
+stored with are current.  Saving or deleting a venue or event bumps its tags
+(``purge``), which invalidates exactly the pages that showed it.
+"""
+import hashlib
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.views.decorators.http import last_modified
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+
+STATS = ('hits', 'misses', 'stale', 'stored', 'bypassed', 'purges')
+
+# every page carries the navbar search form; the masked token in it belongs to
+# the visitor the page was rendered for, so it is swapped out on each hit
+CSRF_INPUT_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def venue_key(venue_id):
+    return f'venue:{venue_id}'
+
+
+def event_key(event_id):
+    return f'event:{event_id}'
+
+
+def add_surrogate_keys(response, *keys):
+    """add_surrogate_keys(response, *keys): Tags ``response`` with the objects it depends on."""
+    if not hasattr(response, 'surrogate_keys'):
+        response.surrogate_keys = set()
+    response.surrogate_keys.update(keys)
+    return response
+
+
+def _count(name, delta=1):
+    key = f'pagecache:stats:{name}'
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+def stats():
+    """stats(): Returns the hit/miss/purge counters shared by every worker using the cache."""
+    values = cache.get_many([f'pagecache:stats:{name}' for name in STATS])
+    counters = {name: values.get(f'pagecache:stats:{name}', 0) for name in STATS}
+    lookups = counters['hits'] + counters['misses'] + counters['stale']
+    counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else 0.0
+    return counters
+
+
+def _tag_key(tag):
+    return f'pagecache:tag:{tag}'
+
+
+def _tag_versions(tags):
+    keys = {_tag_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        # never stored or evicted: seed with the clock rather than 1, so a tag
+        # recreated after eviction cannot come back at a version old pages
+        # were stored with
+        cache.add(key, time.time_ns(), None)
+    if len(found) < len(keys):
+        found = cache.get_many(keys)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def _is_current(versions):
+    if not versions:
+        return True
+    current = cache.get_many([_tag_key(tag) for tag in versions])
+    return all(current.get(_tag_key(tag)) == version for tag, version in versions.items())
+
+
+def _epoch():
+    return cache.get('pagecache:epoch', 0)
+
+
+def purge(*tags):
+    """purge(*tags): Invalidates every cached page tagged with one of ``tags``."""
+    # pages rendered while a purge runs are not stored, see cache_anonymous_page
+    try:
+        cache.incr('pagecache:epoch')
+    except ValueError:
+        cache.add('pagecache:epoch', 1, None)
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:
+            # never stored or evicted: no page can still be validated against it
+            continue
+        _count('purges')
+
+
+def _page_key(request):
+    path = request.get_full_path().encode()
+    return 'pagecache:page:' + hashlib.md5(path).hexdigest()
+
+
+def _cacheable_request(request):
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        # a pending flash message would be baked into the page for everyone
+        and not len(get_messages(request))
+    )
+
+
+def cache_anonymous_page(timeout=None):
+    """Decorator caching a view's 200 responses for anonymous visitors."""
+    if timeout is None:
+        timeout = PAGE_CACHE_TIMEOUT
+
+    def decorator(view):
+        @wraps(view)
+        def _wrapped_view(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                _count('bypassed')
+                return view(request, *args, **kwargs)
+
+            key = _page_key(request)
+            entry = cache.get(key)
+            if entry is not None:
+                if _is_current(entry['tags']):
+                    _count('hits')
+                    content = CSRF_INPUT_RE.sub(
+                        lambda m: m.group(1) + get_token(request).encode() + m.group(2), entry['content'])
+                    response = HttpResponse(content, content_type=entry['content_type'])
+                    response['X-Page-Cache'] = 'HIT'
+                    return response
+                _count('stale')
+            else:
+                _count('misses')
+
+            epoch = _epoch()
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                # versions first: a purge that bumps them after this read also
+                # bumps the epoch, so the page is dropped rather than stored
+                # under versions newer than its content
+                versions = _tag_versions(getattr(response, 'surrogate_keys', ()))
+                if _epoch() == epoch:
+                    cache.set(key, {
+                        'content': response.content,
+                        'content_type': response['Content-Type'],
+                        'tags': versions,
+                    }, timeout)
+                    _count('stored')
+            response['X-Page-Cache'] = 'MISS'
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def anonymous_last_modified(last_modified_func):
+    """Decorator answering conditional GETs from anonymous visitors with 304 Not Modified.
+
+    Logged-in visitors always get a full page: it differs from the anonymous one
+    (navbar, actions) even when the object itself has not changed."""
+    def decorator(view):
+        conditional_view = last_modified(last_modified_func)(view)
+
+        @wraps(view)
+        def _wrapped_view(request, *args, **kwargs):
+            if request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            return conditional_view(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
@@ -0,0 +1,177 @@
+"""Lazy expansion of recurring events.
+
+A recurring ``Event`` is stored once, with a small RRULE subset (daily, weekly
+or monthly, an interval, an optional until date or occurrence count and a list
+of skipped dates).  Occurrences are never written to the database: they are
+generated on demand for a requested window and memoised per window.
+"""
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+
+from django.db.models import Q
+from django.utils import timezone
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+FREQUENCY_CHOICES = [
+    ('', 'Does not repeat'),
+    (DAILY, 'Daily'),
+    (WEEKLY, 'Weekly'),
+    (MONTHLY, 'Monthly'),
+]
+
+# windows memoised by occurrence_dates(); keys include the rule, so an edited
+# series simply misses the cache instead of returning stale dates
+CACHE_SIZE = 8192
+
+
+class Occurrence:
+    """One date of an event.  Attribute access falls through to the event, so templates
+    written for ``Event`` objects render occurrences unchanged."""
+
+    def __init__(self, event, event_date):
+        self.event = event
+        self.event_date = event_date
+
+    def __getattr__(self, name):
+        if name == 'event':
+            raise AttributeError(name)
+        return getattr(self.event, name)
+
+    def __str__(self):
+        return str(self.event)
+
+    def __repr__(self):
+        return f'<Occurrence: {self.event} at {self.event_date}>'
+
+
+def parse_exceptions(value):
+    """parse_exceptions(value): Converts the comma separated YYYY-MM-DD list into a frozenset of dates.
+    Raises ValueError on a malformed date."""
+    dates = set()
+    for part in (value or '').replace('\n', ',').split(','):
+        part = part.strip()
+        if part:
+            dates.add(datetime.strptime(part, '%Y-%m-%d').date())
+    return frozenset(dates)
+
+
+def _to_local(value, tz):
+    # rules are expanded on the wall clock so a weekly 8pm club night stays at
+    # 8pm across daylight saving changes
+    if value.tzinfo is not None:
+        return value.astimezone(tz).replace(tzinfo=None)
+    return value
+
+
+def _add_months(value, months):
+    """Returns ``value`` moved by ``months`` or None when the day does not exist in that month."""
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    try:
+        return value.replace(year=year, month=month)
+    except ValueError:
+        return None
+
+
+def iter_occurrence_dates(dtstart, freq, interval=1, until=None, count=None, exceptions=frozenset(),
+                          start=None, end=None):
+    """iter_occurrence_dates(...): Generator yielding the occurrence datetimes of a rule in [start, end).
+
+    Daily and weekly rules jump straight to the first occurrence inside the window
+    instead of walking from ``dtstart``, so far-future windows cost the same as near ones."""
+    interval = max(interval or 1, 1)
+    # resolved once: looking the zone up per occurrence dominates the cost
+    tz = timezone.get_current_timezone()
+    aware = dtstart.tzinfo is not None
+    first = _to_local(dtstart, tz)
+    until = _to_local(until, tz) if until is not None else None
+    start = _to_local(start, tz) if start is not None else first
+    end = _to_local(end, tz) if end is not None else None
+
+    if not freq:
+        if start <= first and (end is None or first < end) and first.date() not in exceptions:
+            yield dtstart.astimezone(tz) if aware else dtstart
+        return
+
+    if freq == MONTHLY:
+        # months where the day does not exist are skipped and do not count
+        # towards ``count``, so with a count we have to walk from the start
+        index = 0
+        if count is None and start > first:
+            months = (start.year - first.year) * 12 + start.month - first.month
+            index = max(months // interval - 1, 0)
+        produced = 0
+        while True:
+            current = _add_months(first, index * interval)
+            index += 1
+            if current is None:
+                continue
+            produced += 1
+            if count is not None and produced > count:
+                return
+            if (until is not None and current > until) or (end is not None and current >= end):
+                return
+            if current >= start and current.date() not in exceptions:
+                yield current.replace(tzinfo=tz) if aware else current
+
+    step = timedelta(days=interval * (7 if freq == WEEKLY else 1))
+    index = 0
+    if start > first:
+        index = -(-(start - first) // step)  # ceiling division
+    while count is None or index < count:
+        current = first + step * index
+        index += 1
+        if (until is not None and current > until) or (end is not None and current >= end):
+            return
+        if current.date() not in exceptions:
+            yield current.replace(tzinfo=tz) if aware else current
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def occurrence_dates(dtstart, freq, interval, until, count, exceptions, start, end):
+    """occurrence_dates(...): Memoised tuple of the occurrence datetimes of a rule in one window."""
+    return tuple(iter_occurrence_dates(dtstart, freq, interval, until, count, exceptions, start, end))
+
+
+def expand(event, start, end):
+    """expand(event, start, end): Yields an ``Occurrence`` for each date of ``event`` in [start, end)."""
+    dates = occurrence_dates(
+        event.event_date, event.recurrence, event.recurrence_interval, event.recurrence_until,
+        event.recurrence_count, event.exception_dates(), start, end,
+    )
+    for event_date in dates:
+        yield Occurrence(event, event_date)
+
+
+def next_occurrences(event, limit, start=None, horizon=timedelta(days=366)):
+    """next_occurrences(event, limit, start, horizon): Returns up to ``limit`` upcoming occurrences
+    of ``event`` from ``start`` (default: today) within ``horizon``."""
+    if start is None:
+        start = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()))
+    return list(islice(expand(event, start, start + horizon), limit))
+
+
+def window_filter(start, end):
+    """window_filter(start, end): Q object selecting the events that can have an occurrence in
+    [start, end): one-off events dated inside it and series that started before its end and
+    have not finished before its start."""
+    one_off = Q(recurrence='', event_date__gte=start, event_date__lt=end)
+    series = (
+        ~Q(recurrence='') & Q(event_date__lt=end)
+        & (Q(recurrence_until__isnull=True) | Q(recurrence_until__gte=start))
+    )
+    return one_off | series
+
+
+def occurrences_between(queryset, start, end):
+    """occurrences_between(queryset, start, end): Returns the occurrences of the events in
+    ``queryset`` falling in [start, end), sorted by date."""
+    occurrences = []
+    for event in queryset.filter(window_filter(start, end)):
+        occurrences.extend(expand(event, start, end))
+    occurrences.sort(key=lambda occurrence: occurrence.event_date)
+    return occurrences
@@ -0,0 +1,122 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Event, Venue
+from . import notifications, pagecache, sitemaps, stats, typeahead
+
+
+@receiver(pre_save, sender=Event)
+def remember_previous_state(sender, instance, **kwargs):
+    """Keeps the stored venue and dates, so the post_save handlers can tell what changed."""
+    instance._previous = None
+    if instance.pk:
+        instance._previous = (
+            Event.objects.filter(pk=instance.pk)
+            .values(*notifications.TRACKED_FIELDS, *stats.EVENT_FIELDS, 'manager_id').first()
+        )
+
+
+@receiver(post_save, sender=Event)
+def refresh_stats_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    current = stats.event_state(instance)
+    if previous and previous['manager_id'] == instance.manager_id and all(
+            previous[field] == value for field, value in current.items()):
+        return  # nothing the rollup counts has changed
+    stats.schedule_refresh(previous, current)
+
+
+@receiver(post_save, sender=Event)
+def queue_attendee_notifications(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if not created and previous:
+        notifications.enqueue(instance, notifications.diff(previous, instance))
+
+
+@receiver(post_delete, sender=Event)
+def refresh_stats_on_delete(sender, instance, **kwargs):
+    stats.schedule_refresh(stats.event_state(instance))
+
+
+@receiver(m2m_changed, sender=Event.attendees.through)
+def refresh_stats_on_attendees(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # a member is being removed from all of their events; pk_set is not sent for clears
+        instance._stats_cleared = list(instance.event_set.values(*stats.EVENT_FIELDS))
+        return
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        stats.schedule_refresh(stats.event_state(instance))
+    elif action == 'post_clear':
+        stats.schedule_refresh(*getattr(instance, '_stats_cleared', []))
+    else:
+        stats.schedule_refresh(*Event.objects.filter(pk__in=pk_set).values(*stats.EVENT_FIELDS))
+
+
+def _purge_on_commit(*tags):
+    transaction.on_commit(lambda: pagecache.purge(*tags))
+
+
+@receiver(post_save, sender=Venue)
+def purge_venue_pages_on_save(sender, instance, created, **kwargs):
+    if created:
+        _purge_on_commit('venues')
+    else:
+        _purge_on_commit(pagecache.venue_key(instance.pk))
+
+
+@receiver(post_delete, sender=Venue)
+def purge_venue_pages_on_delete(sender, instance, **kwargs):
+    _purge_on_commit('venues', pagecache.venue_key(instance.pk))
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def purge_event_pages(sender, instance, **kwargs):
+    _purge_on_commit('events', pagecache.event_key(instance.pk))
+
+
+@receiver(m2m_changed, sender=Event.attendees.through)
+def purge_event_pages_on_attendees(sender, action, **kwargs):
+    if action.startswith('post_'):
+        _purge_on_commit('events')
+
+
+@receiver(post_save, sender=Venue)
+def index_venue_name(sender, instance, **kwargs):
+    op = ('set', typeahead.VENUE, instance.pk, instance.name)
+    transaction.on_commit(lambda: typeahead.record(op))
+
+
+@receiver(post_delete, sender=Venue)
+def unindex_venue_name(sender, instance, **kwargs):
+    op = ('del', typeahead.VENUE, instance.pk)
+    transaction.on_commit(lambda: typeahead.record(op))
+
+
+@receiver(post_save, sender=Event)
+def index_event_name(sender, instance, **kwargs):
+    op = ('set', typeahead.EVENT, instance.pk, instance.name)
+    transaction.on_commit(lambda: typeahead.record(op))
+
+
+@receiver(post_delete, sender=Event)
+def unindex_event_name(sender, instance, **kwargs):
+    op = ('del', typeahead.EVENT, instance.pk)
+    transaction.on_commit(lambda: typeahead.record(op))
+
+
+@receiver(post_save, sender=Venue)
+@receiver(post_delete, sender=Venue)
+def expire_venue_sitemap(sender, signal, **kwargs):
+    removed = signal is post_delete
+    transaction.on_commit(lambda: sitemaps.bump('venues', removed=removed))
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def expire_event_sitemap(sender, signal, **kwargs):
+    removed = signal is post_delete
+    transaction.on_commit(lambda: sitemaps.bump('events', removed=removed))
@@ -0,0 +1,149 @@
+"""Sitemaps for venue and event pages.
+
+Crawlers get every ``show_venue``/``show_event`` URL from ``sitemap.xml``
+instead of paging through ``list_venues``.  Each section is split into files
+of ``URLS_PER_FILE`` URLs.  Building the index streams ``(id, updated)`` over
+the table once in chunks and remembers where each file starts, so a file is
+then read with an id range rather than an OFFSET.  Everything is cached under
+a per-section version that saves and deletes bump, and ``lastmod`` tells
+crawlers which pages changed.
+"""
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.html import escape
+
+from .models import Event, Venue
+
+URLS_PER_FILE = 50000
+CHUNK_SIZE = 5000
+CACHE_TIMEOUT = 24 * 60 * 60
+
+SECTIONS = {
+    'venues': (Venue, 'show-venue'),
+    'events': (Event, 'show-event'),
+}
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _version_key(section):
+    return f'sitemap:version:{section}'
+
+
+def version(section):
+    return cache.get_or_set(_version_key(section), 1, None)
+
+
+def _removed_key(section):
+    return f'sitemap:removed:{section}'
+
+
+def bump(section, removed=False):
+    """bump(section, removed): Marks the cached sitemap files of ``section`` as out of date.  Pass
+    ``removed`` when rows were deleted: the ``updated`` dates left in a file cannot show that."""
+    if removed:
+        cache.set(_removed_key(section), datetime.now(timezone.utc), None)
+    try:
+        cache.incr(_version_key(section))
+    except ValueError:
+        pass
+
+
+def _lastmod(value):
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+
+def pages(section):
+    """pages(section): Returns one ``(first_id, last_id, lastmod)`` per sitemap file of ``section``.
+    ``lastmod`` is the newest ``updated`` in the file, or the last deletion in the section if later."""
+    key = f'sitemap:pages:{section}:{version(section)}'
+    result = cache.get(key)
+    if result is None:
+        model = SECTIONS[section][0]
+        result = []
+        rows = model.objects.order_by('pk').values_list('pk', 'updated').iterator(chunk_size=CHUNK_SIZE)
+        for i, (pk, updated) in enumerate(rows):
+            if i % URLS_PER_FILE == 0:
+                result.append([pk, pk, updated])
+            page = result[-1]
+            page[1] = pk
+            if updated > page[2]:
+                page[2] = updated
+        result = [tuple(page) for page in result]
+        cache.set(key, result, CACHE_TIMEOUT)
+    removed = cache.get(_removed_key(section))
+    if removed is not None:
+        # a file may have lost a URL at that time; which one is not recorded
+        result = [(first_id, last_id, max(lastmod, removed)) for first_id, last_id, lastmod in result]
+    return result
+
+
+def last_modified(section=None, page=None):
+    """last_modified(section, page): Newest change in one sitemap file, one section or all of them."""
+    if section is not None and section not in SECTIONS:
+        return None
+    sections = [section] if section else list(SECTIONS)
+    dates = []
+    for name in sections:
+        files = pages(name)
+        if page is not None:
+            files = files[page - 1:page]
+        dates.extend(lastmod for _, _, lastmod in files)
+    return max(dates) if dates else None
+
+
+def index_xml(base_url):
+    """index_xml(base_url): Returns the sitemap index listing every section file."""
+    key = f'sitemap:index:{base_url}:' + ':'.join(str(version(section)) for section in SECTIONS)
+    xml = cache.get(key)
+    if xml is None:
+        entries = []
+        for section in SECTIONS:
+            for number, (_, _, lastmod) in enumerate(pages(section), start=1):
+                loc = base_url + reverse('sitemap-section', args=[section, number])
+                entries.append(f'<sitemap><loc>{escape(loc)}</loc><lastmod>{_lastmod(lastmod)}</lastmod></sitemap>\n')
+        xml = f'{XML_HEADER}<sitemapindex xmlns="{NAMESPACE}">\n{"".join(entries)}</sitemapindex>\n'
+        cache.set(key, xml, CACHE_TIMEOUT)
+    return xml
+
+
+def section_xml(base_url, section, number):
+    """section_xml(base_url, section, number): Yields the sitemap file ``number`` of ``section`` in
+    chunks, reading its id range with a chunked iterator.  Returns None if it does not exist."""
+    files = pages(section)
+    if not 1 <= number <= len(files):
+        return None
+    key = f'sitemap:file:{base_url}:{section}:{number}:{version(section)}'
+    xml = cache.get(key)
+    if xml is not None:
+        return iter([xml])
+    return _stream_section(base_url, section, files[number - 1], key)
+
+
+def _stream_section(base_url, section, page, key):
+    model, url_name = SECTIONS[section]
+    first_id, last_id, _ = page
+    # reverse once and substitute the id, instead of resolving 50k URLs
+    placeholder = 999999999999
+    template = escape(base_url + reverse(url_name, args=[placeholder]))
+    prefix, suffix = template.split(str(placeholder))
+    parts = [f'{XML_HEADER}<urlset xmlns="{NAMESPACE}">\n']
+    yield parts[0]
+    rows = (model.objects.filter(pk__gte=first_id, pk__lte=last_id).order_by('pk')
+            .values_list('pk', 'updated').iterator(chunk_size=CHUNK_SIZE))
+    chunk = []
+    for pk, updated in rows:
+        chunk.append(f'<url><loc>{prefix}{pk}{suffix}</loc><lastmod>{_lastmod(updated)}</lastmod></url>\n')
+        if len(chunk) >= CHUNK_SIZE:
+            text = ''.join(chunk)
+            parts.append(text)
+            yield text
+            chunk = []
+    text = ''.join(chunk) + '</urlset>\n'
+    parts.append(text)
+    yield text
+    # only a file streamed to the end is cached
+    cache.set(key, ''.join(parts), CACHE_TIMEOUT)
@@ -0,0 +1,245 @@
+"""Monthly venue utilisation rollups.
+
+``VenueMonthlyStats`` holds one row per venue per month.  Rows are refreshed
+incrementally from the ``Event`` signals (only the touched venue/month buckets
+are recomputed, and saves that change nothing counted are skipped) and can be
+rebuilt in one pass with ``reconcile()``, which the ``reconcile_venue_stats``
+management command runs periodically.  Archived events keep counting towards
+the months they happened in.
+
+A recurring series counts once for every occurrence in a month.  Open-ended
+series are counted up to ``HORIZON`` ahead; ``reconcile()`` moves that horizon
+forward as time passes.  A series can span dozens of months, so its buckets
+are not recomputed in the request: they are queued as ``StatsRefresh`` rows,
+in the same transaction as the change, for ``refresh_queued()``
+(``reconcile_venue_stats --queued``).
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import ArchivedAttendance, ArchivedEvent, Event, StatsRefresh, VenueMonthlyStats
+from . import recurrence as rrule
+
+STAT_FIELDS = ('event_count', 'attendee_count', 'manager_count')
+HORIZON = timedelta(days=366)
+SERIES_FIELDS = ('id', 'manager', 'event_date', 'recurrence', 'recurrence_interval', 'recurrence_until',
+                 'recurrence_count', 'recurrence_exceptions')
+# the event columns deciding which buckets it counts towards
+EVENT_FIELDS = ('venue_id', 'event_date', 'recurrence', 'recurrence_interval', 'recurrence_until',
+                'recurrence_count', 'recurrence_exceptions')
+
+
+def month_start(value):
+    """month_start(value): Returns the first day of the month containing the datetime ``value``,
+    in the current time zone (the same bucketing TruncMonth uses)."""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def month_bounds(month):
+    """month_bounds(month): Returns the aware [start, end) datetimes of the month starting at ``month``."""
+    next_month_start = next_month(month)
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(month, time.min), tz)
+    end = timezone.make_aware(datetime.combine(next_month_start, time.min), tz)
+    return start, end
+
+
+def series_end(recurrence, recurrence_until):
+    """series_end(recurrence, recurrence_until): The date up to which a series can have occurrences
+    to count, ``None`` for one-off events."""
+    if not recurrence:
+        return None
+    horizon = timezone.now() + HORIZON
+    return min(recurrence_until, horizon) if recurrence_until else horizon
+
+
+def event_state(event):
+    """event_state(event): The ``EVENT_FIELDS`` of ``event`` as a dict, the form ``schedule_refresh``
+    takes."""
+    return {field: getattr(event, field) for field in EVENT_FIELDS}
+
+
+def event_buckets(state):
+    """event_buckets(state): The venue/month buckets holding an occurrence of the event described
+    by ``state``, a dict of its ``EVENT_FIELDS``."""
+    venue_id, event_date = state['venue_id'], state['event_date']
+    if venue_id is None or event_date is None:
+        return set()
+    if not state['recurrence']:
+        return {(venue_id, month_start(event_date))}
+    try:
+        exceptions = rrule.parse_exceptions(state['recurrence_exceptions'])
+    except ValueError:
+        exceptions = frozenset()
+    dates = rrule.iter_occurrence_dates(
+        event_date, state['recurrence'], state['recurrence_interval'], state['recurrence_until'],
+        state['recurrence_count'], exceptions, end=series_end(state['recurrence'], state['recurrence_until']),
+    )
+    return {(venue_id, month_start(date)) for date in dates}
+
+
+def _occurring(model, venue_id, start, end):
+    # occurrences per event of the venue in [start, end), and the managers of those events
+    counts, managers = {}, set()
+    events = model.objects.filter(rrule.window_filter(start, end), venue_id=venue_id).only(*SERIES_FIELDS)
+    for event in events:
+        count = sum(1 for _ in rrule.expand(event, start, end))
+        if count:
+            counts[event.pk] = count
+            managers.add(event.manager_id)
+    return counts, managers
+
+
+def _bucket_values(venue_id, month):
+    start, end = month_bounds(month)
+    live, live_managers = _occurring(Event, venue_id, start, end)
+    archived, archived_managers = _occurring(ArchivedEvent, venue_id, start, end)
+    attendees = set(Event.attendees.through.objects.filter(event_id__in=live)
+                    .values_list('myclubuser_id', flat=True))
+    attendees.update(ArchivedAttendance.objects.filter(event_id__in=archived)
+                     .values_list('myclubuser_id', flat=True))
+    managers = (live_managers | archived_managers) - {None}
+    return {
+        'event_count': sum(live.values()) + sum(archived.values()),
+        'attendee_count': len(attendees),
+        'manager_count': len(managers),
+    }
+
+
+def refresh_bucket(venue_id, month):
+    """refresh_bucket(venue_id, month): Recomputes the rollup row of one venue for one month."""
+    values = _bucket_values(venue_id, month)
+    if values['event_count']:
+        VenueMonthlyStats.objects.update_or_create(venue_id=venue_id, month=month, defaults=values)
+    else:
+        VenueMonthlyStats.objects.filter(venue_id=venue_id, month=month).delete()
+
+
+def _pending(connection):
+    # buckets waiting for their on_commit refresh, kept per connection (so per
+    # thread): a concurrent transaction's commit must not consume our buckets
+    if not hasattr(connection, 'stats_pending'):
+        connection.stats_pending = set()
+    return connection.stats_pending
+
+
+def _refresh_pending(pending, bucket):
+    # several saves in one transaction schedule the same bucket; only the first
+    # callback after commit does the work
+    if bucket in pending:
+        pending.discard(bucket)
+        refresh_bucket(*bucket)
+
+
+def schedule_refresh(*states):
+    """schedule_refresh(*states): Refreshes the buckets of the events described by ``states``
+    (dicts of ``EVENT_FIELDS``, e.g. before and after a change; ``None`` is skipped).
+
+    The month of a one-off event is recomputed once the current transaction commits; the
+    months of a series are queued for ``refresh_queued()``."""
+    now, queued = set(), set()
+    for state in states:
+        if state:
+            (queued if state['recurrence'] else now).update(event_buckets(state))
+    queued -= now
+    if queued:
+        queued_at = timezone.now()
+        StatsRefresh.objects.bulk_create(
+            [StatsRefresh(venue_id=venue_id, month=month, queued=queued_at)
+             for venue_id, month in sorted(queued)],
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=('venue', 'month'),
+            update_fields=('queued',),
+        )
+    pending = _pending(transaction.get_connection())
+    for bucket in now:
+        pending.add(bucket)
+        transaction.on_commit(lambda bucket=bucket: _refresh_pending(pending, bucket))
+
+
+def refresh_queued(batch_size=500):
+    """refresh_queued(batch_size): Recomputes the buckets queued by ``schedule_refresh``, oldest
+    first, and returns how many were refreshed."""
+    refreshed = 0
+    while True:
+        rows = list(StatsRefresh.objects.values_list('id', 'venue_id', 'month', 'queued')[:batch_size])
+        if not rows:
+            return refreshed
+        for pk, venue_id, month, queued in rows:
+            with transaction.atomic():
+                refresh_bucket(venue_id, month)
+                # queued again meanwhile: keep the row, the change may not have been counted
+                StatsRefresh.objects.filter(pk=pk, queued=queued).delete()
+            refreshed += 1
+
+
+def _grouped(model):
+    rows = (
+        model.objects.filter(venue__isnull=False, recurrence='')
+        .annotate(month=TruncMonth('event_date', output_field=DateField()))
+        .values('venue', 'month')
+        .annotate(
+            event_count=Count('id', distinct=True),
+            attendee_count=Count('attendees', distinct=True),
+            manager_count=Count('manager', distinct=True),
+        )
+        .order_by()
+    )
+    return {(row['venue'], row['month']): {f: row[f] for f in STAT_FIELDS} for row in rows}
+
+
+def _series_buckets(model):
+    # the venue/months holding at least one occurrence of a series
+    buckets = set()
+    for event in model.objects.filter(venue__isnull=False).exclude(recurrence='').only('venue', *SERIES_FIELDS):
+        buckets.update(event_buckets(event_state(event)))
+    return buckets
+
+
+def reconcile():
+    """reconcile(): Rebuilds every rollup row with one GROUP BY month aggregate over the one-off
+    events of ``Event`` and one over the archive; months holding occurrences of a series are
+    counted one by one.  This also covers the buckets queued until then.
+
+    Returns a ``(written, deleted)`` tuple of row counts."""
+    started = timezone.now()
+    buckets = _grouped(ArchivedEvent)
+    for key, values in _grouped(Event).items():
+        buckets[key] = _bucket_values(*key) if key in buckets else values
+    for key in _series_buckets(Event) | _series_buckets(ArchivedEvent):
+        buckets[key] = _bucket_values(*key)
+    stats = [
+        VenueMonthlyStats(venue_id=venue_id, month=month, **values)
+        for (venue_id, month), values in buckets.items()
+    ]
+    keys = set(buckets)
+    with transaction.atomic():
+        VenueMonthlyStats.objects.bulk_create(
+            stats,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=('venue', 'month'),
+            update_fields=STAT_FIELDS + ('updated',),
+        )
+        stale = [
+            pk for pk, venue_id, month in VenueMonthlyStats.objects.values_list('id', 'venue_id', 'month')
+            if (venue_id, month) not in keys
+        ]
+        deleted = 0
+        for i in range(0, len(stale), 500):
+            deleted += VenueMonthlyStats.objects.filter(pk__in=stale[i:i + 500]).delete()[0]
+        StatsRefresh.objects.filter(queued__lte=started).delete()
+    return len(stats), deleted
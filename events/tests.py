@@ -1,3 +1,553 @@
-from django.test import TestCase
+import io
+import tempfile
+import time
+import zoneinfo
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import archive, bookings, bulk, notifications, pagecache, recurrence as rrule, stats, throttling
+from .models import (ArchivedEvent, Event, MyClubUser, NotificationBatch, NotificationDelivery, StatsRefresh, Venue,
+                     VenueMonthlyStats)
+
+
+class CountingBackend(EmailBackend):
+    """locmem backend remembering the size of every send_messages call and how often it was
+    opened, failing on the calls in ``fail_on`` or on every call from ``fail_from`` on."""
+
+    def __init__(self, *args, fail_from=None, fail_on=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+        self.attempts = 0
+        self.opened = 0
+        self.fail_from = fail_from
+        self.fail_on = set(fail_on)
+
+    def open(self):
+        self.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        attempt, self.attempts = self.attempts, self.attempts + 1
+        if attempt in self.fail_on or (self.fail_from is not None and attempt >= self.fail_from):
+            raise ConnectionError('connection dropped')
+        self.calls.append(len(messages))
+        return super().send_messages(messages)
+
+
+class RecurrenceTests(SimpleTestCase):
+    def dates(self, dtstart, freq, start=None, end=None, **rule):
+        return list(rrule.iter_occurrence_dates(dtstart, freq, start=start, end=end, **rule))
+
+    def test_weekly_window_after_start_with_interval_and_count(self):
+        monday = datetime(2030, 1, 7, 20)
+        march, april = datetime(2030, 3, 1), datetime(2030, 4, 1)
+        self.assertEqual(self.dates(monday, rrule.WEEKLY, march, april, interval=2),
+                         [datetime(2030, 3, 4, 20), datetime(2030, 3, 18, 20)])
+        # the fifth occurrence is the first inside the window
+        self.assertEqual(self.dates(monday, rrule.WEEKLY, march, april, interval=2, count=5),
+                         [datetime(2030, 3, 4, 20)])
+        self.assertEqual(self.dates(monday, rrule.WEEKLY, march, april, interval=2, count=4), [])
+
+    def test_window_start_is_inclusive_and_end_exclusive(self):
+        monday = datetime(2030, 1, 7, 20)
+        self.assertEqual(self.dates(monday, rrule.WEEKLY, datetime(2030, 1, 14, 20), datetime(2030, 1, 28, 20)),
+                         [datetime(2030, 1, 14, 20), datetime(2030, 1, 21, 20)])
+
+    def test_daily_until(self):
+        first = datetime(2030, 1, 1, 9)
+        self.assertEqual(self.dates(first, rrule.DAILY, datetime(2030, 1, 5), interval=3,
+                                    until=datetime(2030, 1, 13, 9)),
+                         [datetime(2030, 1, 7, 9), datetime(2030, 1, 10, 9), datetime(2030, 1, 13, 9)])
+
+    def test_monthly_on_the_31st_skips_short_months(self):
+        first = datetime(2030, 1, 31, 19)
+        self.assertEqual([d.month for d in self.dates(first, rrule.MONTHLY, end=datetime(2031, 1, 1))],
+                         [1, 3, 5, 7, 8, 10, 12])
+        self.assertEqual(self.dates(first, rrule.MONTHLY, datetime(2030, 6, 1), datetime(2030, 9, 1)),
+                         [datetime(2030, 7, 31, 19), datetime(2030, 8, 31, 19)])
+        self.assertEqual(self.dates(first, rrule.MONTHLY, datetime(2030, 8, 1), datetime(2031, 3, 1), interval=2),
+                         [datetime(2031, 1, 31, 19)])
+
+    def test_monthly_count_only_counts_months_that_have_the_day(self):
+        first = datetime(2030, 1, 31, 19)
+        self.assertEqual([d.month for d in self.dates(first, rrule.MONTHLY, count=3)], [1, 3, 5])
+        self.assertEqual(self.dates(first, rrule.MONTHLY, datetime(2030, 4, 1), count=3),
+                         [datetime(2030, 5, 31, 19)])
+
+    def test_exceptions_are_skipped_but_still_count(self):
+        monday = datetime(2030, 1, 7, 20)
+        self.assertEqual(self.dates(monday, rrule.WEEKLY, count=3, exceptions=frozenset({date(2030, 1, 14)})),
+                         [datetime(2030, 1, 7, 20), datetime(2030, 1, 21, 20)])
+        first = datetime(2030, 1, 31, 19)
+        self.assertEqual(self.dates(first, rrule.MONTHLY, count=3, exceptions=frozenset({date(2030, 3, 31)})),
+                         [datetime(2030, 1, 31, 19), datetime(2030, 5, 31, 19)])
+        self.assertEqual(rrule.parse_exceptions('2030-01-14, 2030-03-31\n'), {date(2030, 1, 14), date(2030, 3, 31)})
+
+    def test_aware_series_keep_their_wall_clock_time(self):
+        london = zoneinfo.ZoneInfo('Europe/London')
+        with timezone.override(london):
+            first = datetime(2030, 3, 24, 20, tzinfo=london)
+            dates = self.dates(first, rrule.WEEKLY, count=2)
+        self.assertEqual([d.astimezone(london).hour for d in dates], [20, 20])
+        self.assertEqual([d.astimezone(zoneinfo.ZoneInfo('UTC')).hour for d in dates], [20, 19])
+
+    def test_windows_are_memoised_per_rule(self):
+        event = Event(name='Weekly', event_date=timezone.make_aware(datetime(2030, 1, 7, 20)), recurrence='weekly')
+        start, end = timezone.make_aware(datetime(2030, 2, 1)), timezone.make_aware(datetime(2030, 3, 1))
+        first = [occurrence.event_date for occurrence in rrule.expand(event, start, end)]
+        hits = rrule.occurrence_dates.cache_info().hits
+        self.assertEqual([occurrence.event_date for occurrence in rrule.expand(event, start, end)], first)
+        self.assertEqual(rrule.occurrence_dates.cache_info().hits, hits + 1)
+        event.recurrence_interval = 2
+        self.assertEqual(len(list(rrule.expand(event, start, end))), 2)
+        self.assertEqual(len(first), 4)
+
+
+class BookingTests(TestCase):
+    def setUp(self):
+        self.hall = Venue.objects.create(name='Hall', address='1 Main St')
+        self.annex = Venue.objects.create(name='Annex', address='2 Main St')
+        self.start = timezone.make_aware(datetime(2030, 5, 1, 19))
+
+    def book(self, name, hours, length=2, venue=None, **rule):
+        start = self.start + timedelta(hours=hours)
+        return Event.objects.create(name=name, event_date=start, end_date=start + timedelta(hours=length),
+                                    venue=venue or self.hall, **rule)
+
+    def pairs(self, queryset=None):
+        return [(earlier.name, later.name)
+                for earlier, later in bookings.find_conflicts(bookings.iter_bookings(queryset))]
+
+    def test_sweep_finds_only_overlaps_at_the_same_venue(self):
+        self.book('A', 0)
+        self.book('B', 1)
+        self.book('C', 3)  # starts when B ends
+        self.book('D', 0, venue=self.annex)
+        self.assertEqual(self.pairs(), [('A', 'B')])
+
+    def test_sweep_expands_series(self):
+        self.book('A', 0)
+        self.book('Weekly', -7 * 24 + 1, recurrence='weekly', recurrence_count=3)
+        self.book('Ended', -7 * 24 + 1, venue=self.annex, recurrence='weekly', recurrence_count=1)
+        self.assertEqual(self.pairs(), [('A', 'Weekly')])
+        self.assertEqual(self.pairs(Event.objects.filter(venue=self.annex)), [])
+
+    def test_conflicts_with_an_unsaved_event(self):
+        self.book('A', 0)
+        self.book('Weekly', 24, recurrence='daily')
+        event = Event(name='New', event_date=self.start + timedelta(hours=1), venue=self.hall, recurrence='daily',
+                      recurrence_count=2)
+        clashes = bookings.conflicts_with(event)
+        self.assertEqual(sorted((own.id, other.name) for own, other in clashes), [(0, 'A'), (0, 'Weekly')])
+        self.assertEqual(sorted(event.conflicting_events().values_list('name', flat=True)), ['A', 'Weekly'])
+
+    def test_clean_refuses_a_double_booking(self):
+        self.book('A', 0)
+        event = Event(name='New', event_date=self.start + timedelta(hours=1), venue=self.hall)
+        with self.assertRaisesMessage(ValidationError, 'Hall is already booked at that time by: A.'):
+            event.clean()
+        event.venue = self.annex
+        event.clean()
+
+    def test_find_venue_conflicts_command(self):
+        self.book('A', 0)
+        self.book('B', 1)
+        out = io.StringIO()
+        call_command('find_venue_conflicts', stdout=out)
+        self.assertIn('"A" (#', out.getvalue())
+        self.assertIn('1 conflicting bookings found.', out.getvalue())
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        self.hall = Venue.objects.create(name='Hall', address='1 Main St')
+        self.annex = Venue.objects.create(name='Annex', address='2 Main St')
+        self.manager = User.objects.create_user('manager')
+        self.members = [MyClubUser.objects.create(first_name='M', last_name=str(i), email=f'm{i}@example.com')
+                        for i in range(3)]
+        self.start = timezone.now().replace(microsecond=0) - timedelta(days=3 * 365)
+
+    def rollup(self):
+        return {(row.venue_id, row.month): (row.event_count, row.attendee_count, row.manager_count)
+                for row in VenueMonthlyStats.objects.all()}
+
+    def test_incremental_refresh_matches_reconcile(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            weekly = Event.objects.create(name='Weekly', event_date=self.start, venue=self.hall, recurrence='weekly',
+                                          recurrence_until=self.start + timedelta(days=400))
+            night = Event.objects.create(name='Night', event_date=self.start + timedelta(days=3), venue=self.hall,
+                                         manager=self.manager)
+        with self.captureOnCommitCallbacks(execute=True):
+            weekly.attendees.add(*self.members[:2])
+            night.attendees.add(self.members[2])
+            night.venue = self.annex
+            night.save()
+            weekly.recurrence_interval = 2
+            weekly.save()
+            self.members[0].event_set.clear()
+        stats.refresh_queued()
+        incremental = self.rollup()
+        self.assertTrue(incremental)
+        stats.reconcile()
+        self.assertEqual(incremental, self.rollup())
+        self.assertFalse(StatsRefresh.objects.exists())
+
+    def test_saves_not_changing_the_counts_are_skipped(self):
+        weekly = Event.objects.create(name='Weekly', event_date=self.start, venue=self.hall, recurrence='weekly')
+        StatsRefresh.objects.all().delete()
+        weekly.description = 'Bring a friend'
+        with mock.patch.object(stats, 'refresh_bucket') as refresh, self.captureOnCommitCallbacks(execute=True):
+            weekly.save()
+        self.assertFalse(refresh.called)
+        self.assertFalse(StatsRefresh.objects.exists())
+
+    def test_series_buckets_are_queued_not_recomputed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            weekly = Event.objects.create(name='Weekly', event_date=self.start, venue=self.hall,
+                                          recurrence='weekly')
+        with self.assertNumQueries(3), self.captureOnCommitCallbacks(execute=True):
+            weekly.attendees.add(self.members[0])
+        self.assertEqual(self.rollup(), {})
+        months = set(StatsRefresh.objects.values_list('month', flat=True))
+        self.assertGreater(len(months), 40)
+        self.assertEqual(stats.refresh_queued(), len(months))
+        self.assertEqual({month for _, month in self.rollup()}, months)
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        self.hall = Venue.objects.create(name='Hall', address='1 Main St')
+        self.annex = Venue.objects.create(name='Annex', address='2 Main St')
+        self.start = timezone.make_aware(datetime(2030, 5, 1, 19))
+        self.event = Event.objects.create(name='Club night', event_date=self.start, venue=self.hall)
+        members = [MyClubUser.objects.create(first_name='M', last_name=str(i), email=f'member{i}@example.com')
+                   for i in range(5)]
+        self.event.attendees.add(*members)
+
+    def move(self, **values):
+        for field, value in values.items():
+            setattr(self.event, field, value)
+        self.event.save()
+
+    def test_diff_lists_only_changed_fields(self):
+        previous = {'event_date': self.start, 'end_date': self.event.end_date, 'venue_id': self.hall.pk}
+        self.event.venue = self.annex
+        changes = notifications.diff(previous, self.event)
+        self.assertEqual(changes, {'venue_id': {'old': self.hall.pk, 'new': self.annex.pk}})
+
+    def test_later_changes_merge_into_the_pending_batch(self):
+        self.move(venue=self.annex)
+        self.move(event_date=self.start + timedelta(days=1), end_date=self.event.end_date + timedelta(days=1))
+        batch = NotificationBatch.objects.get(event=self.event)
+        self.assertEqual(batch.status, NotificationBatch.PENDING)
+        self.assertEqual(set(batch.changes), {'venue_id', 'event_date', 'end_date'})
+        self.assertEqual(batch.changes['venue_id']['old'], self.hall.pk)
+
+    def test_changing_back_drops_the_batch(self):
+        self.move(venue=self.annex)
+        self.move(venue=self.hall)
+        self.assertFalse(NotificationBatch.objects.filter(event=self.event).exists())
+
+    def test_messages_are_sent_over_one_connection_and_recorded_in_chunks(self):
+        self.move(venue=self.annex)
+        connection = CountingBackend()
+        result = notifications.send_pending(connection=connection, chunk_size=2)
+        self.assertEqual((connection.opened, len(connection.calls)), (1, 5))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         [f'member{i}@example.com' for i in range(5)])
+        self.assertEqual(NotificationBatch.objects.get(event=self.event).status, NotificationBatch.SENT)
+        self.assertEqual((result['batches'], result['messages']), (1, 5))
+
+    def test_retry_only_mails_the_attendees_not_reached(self):
+        self.move(venue=self.annex)
+        # the second message fails, and again after reconnecting
+        result = notifications.send_pending(connection=CountingBackend(fail_from=1), chunk_size=2)
+        batch = NotificationBatch.objects.get(event=self.event)
+        self.assertEqual((result['failed'], batch.attempts, batch.status), (0, 1, NotificationBatch.PENDING))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(NotificationDelivery.objects.filter(batch=batch).count(), 1)
+
+        NotificationBatch.objects.filter(pk=batch.pk).update(next_attempt=timezone.now())
+        result = notifications.send_pending(connection=CountingBackend(), chunk_size=2)
+        self.assertEqual(result['messages'], 4)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(len(recipients), 5)
+        self.assertEqual(len(set(recipients)), 5)
+
+    def test_failure_mid_chunk_resumes_after_the_delivered_messages(self):
+        self.move(venue=self.annex)
+        connection = CountingBackend(fail_on={2})
+        result = notifications.send_pending(connection=connection, chunk_size=5)
+        recipients = [message.to[0] for message in mail.outbox]
+        self.assertEqual(sorted(recipients), [f'member{i}@example.com' for i in range(5)])
+        self.assertEqual((result['messages'], connection.opened), (5, 2))
+        self.assertEqual(NotificationBatch.objects.get(event=self.event).status, NotificationBatch.SENT)
+
+    def test_failed_batches_give_up_after_max_attempts(self):
+        self.move(venue=self.annex)
+        result = notifications.send_pending(connection=CountingBackend(fail_from=0), max_attempts=1)
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(NotificationBatch.objects.get(event=self.event).status, NotificationBatch.FAILED)
+
+    def test_report_includes_throughput(self):
+        self.move(venue=self.annex)
+        result = notifications.send_pending(connection=CountingBackend())
+        self.assertEqual(set(result), {'batches', 'failed', 'messages', 'seconds', 'messages_per_second'})
+        self.assertGreater(result['messages_per_second'], 0)
+
+    def test_file_backend(self):
+        self.move(venue=self.annex)
+        with tempfile.TemporaryDirectory() as directory:
+            connection = get_connection('django.core.mail.backends.filebased.EmailBackend', file_path=directory)
+            result = notifications.send_pending(connection=connection)
+            written = ''.join(path.read_text() for path in Path(directory).iterdir())
+        self.assertEqual(result['messages'], 5)
+        self.assertEqual(written.count('Subject: Change to Club night'), 5)
+        self.assertIn('Venue: Hall -> Annex', written)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.hall = Venue.objects.create(name='Hall', address='1 Main St')
+        self.manager = User.objects.create_user('manager')
+        self.start = timezone.make_aware(datetime(2030, 1, 7, 19))
+
+    def series(self, name, **rule):
+        return Event.objects.create(name=name, event_date=self.start, venue=self.hall, manager=self.manager,
+                                    recurrence='weekly', **rule)
+
+    def archivable(self, cutoff):
+        return sorted(archive.archivable(cutoff).values_list('name', flat=True))
+
+    def test_series_bounded_by_count_are_archived_after_their_last_occurrence(self):
+        self.series('Three weeks', recurrence_count=3)
+        self.series('Open ended')
+        last_ends = self.start + timedelta(weeks=2, hours=2)
+        self.assertEqual(self.archivable(last_ends), [])
+        self.assertEqual(self.archivable(last_ends + timedelta(seconds=1)), ['Three weeks'])
+        past = bulk.past_events(self.manager, last_ends + timedelta(days=1))
+        self.assertEqual(list(past.values_list('name', flat=True)), ['Three weeks'])
+
+    def test_skipped_last_occurrence_ends_the_series_earlier(self):
+        self.series('Three weeks', recurrence_count=3, recurrence_exceptions='2030-01-21')
+        self.assertEqual(self.archivable(self.start + timedelta(weeks=1, hours=3)), ['Three weeks'])
+
+    def test_until_and_count_whichever_comes_first(self):
+        self.series('Until', recurrence_until=self.start + timedelta(weeks=1))
+        self.series('Count first', recurrence_count=2, recurrence_until=self.start + timedelta(weeks=10))
+        self.assertEqual(self.archivable(self.start + timedelta(weeks=2)), ['Count first', 'Until'])
+
+    def test_archive_before_moves_finished_series(self):
+        event = self.series('Three weeks', recurrence_count=3)
+        event.attendees.add(MyClubUser.objects.create(first_name='M', last_name='1', email='m1@example.com'))
+        moved = sum(archive.archive_before(self.start + timedelta(weeks=4)))
+        self.assertEqual(moved, 1)
+        self.assertFalse(Event.objects.exists())
+        self.assertEqual(ArchivedEvent.objects.get(pk=event.pk).attendees.count(), 1)
+
+
+class BulkOperationTests(TestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user('manager', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        self.hall = Venue.objects.create(name='Hall', address='1 Main St')
+        self.annex = Venue.objects.create(name='Annex', address='2 Main St')
+        self.start = timezone.make_aware(datetime(2030, 5, 1, 19))
+        self.events = [Event.objects.create(name=f'Night {i}', event_date=self.start + timedelta(days=i),
+                                            venue=self.hall, manager=self.manager) for i in range(3)]
+        self.selection = Event.objects.filter(manager=self.manager)
+
+    def test_plan_is_a_dry_run(self):
+        result = bulk.plan(self.manager, self.selection, bulk.MOVE, venue=self.annex)
+        self.assertEqual(len(result), 3)
+        self.assertEqual({change.after['venue_id'] for change in result.changes}, {self.annex.pk})
+        self.assertEqual(Event.objects.filter(venue=self.annex).count(), 0)
+
+    def test_apply_moves_the_events(self):
+        bulk.apply(self.manager, self.selection, bulk.MOVE, venue=self.annex)
+        self.assertEqual(Event.objects.filter(venue=self.annex).count(), 3)
+
+    def test_apply_shifts_start_and_end(self):
+        before = {event.pk: (event.event_date, event.end_date) for event in self.events}
+        bulk.apply(self.manager, self.selection, bulk.SHIFT, delta=timedelta(days=7))
+        for event in Event.objects.all():
+            start, end = before[event.pk]
+            self.assertEqual((event.event_date, event.end_date), (start + timedelta(days=7), end + timedelta(days=7)))
+
+    def test_back_to_back_events_shift_onto_each_others_slots(self):
+        # weekly nights entered as separate rows: each moves onto the slot of the next
+        weeks = [Event.objects.create(name=f'Week {i}', event_date=self.start + timedelta(weeks=i), venue=self.annex,
+                                      manager=self.manager) for i in range(3)]
+        selection = Event.objects.filter(pk__in=[event.pk for event in weeks])
+        self.assertEqual(bulk.plan(self.manager, selection, bulk.SHIFT, delta=timedelta(weeks=1)).conflicts, [])
+        bulk.apply(self.manager, selection, bulk.SHIFT, delta=timedelta(weeks=1))
+        self.assertEqual(sorted(selection.values_list('event_date', flat=True)),
+                         [self.start + timedelta(weeks=i) for i in range(1, 4)])
+
+    def test_apply_deletes_in_batches(self):
+        bulk.apply(self.manager, self.selection, bulk.DELETE)
+        self.assertFalse(Event.objects.exists())
+
+    def test_events_of_other_managers_are_refused(self):
+        foreign = Event.objects.create(name='Theirs', event_date=self.start + timedelta(days=30), venue=self.hall,
+                                       manager=self.other)
+        selection = Event.objects.filter(pk__in=[self.events[0].pk, foreign.pk])
+        with self.assertRaises(PermissionDenied):
+            bulk.plan(self.manager, selection, bulk.DELETE)
+        with self.assertRaises(PermissionDenied):
+            bulk.apply(self.manager, selection, bulk.DELETE)
+        self.assertEqual(Event.objects.count(), 4)
+
+    def test_double_bookings_are_refused(self):
+        Event.objects.create(name='Taken', event_date=self.start, venue=self.annex, manager=self.other)
+        result = bulk.plan(self.manager, self.selection, bulk.MOVE, venue=self.annex)
+        self.assertEqual(len(result.conflicts), 1)
+        with self.assertRaises(ValidationError):
+            bulk.apply(self.manager, self.selection, bulk.MOVE, venue=self.annex)
+        self.assertEqual(Event.objects.filter(venue=self.annex).count(), 1)
+
+    def test_clashes_with_later_occurrences_of_a_series(self):
+        Event.objects.create(name='Weekly', event_date=self.start - timedelta(days=6), venue=self.annex,
+                             recurrence='weekly', manager=self.other)
+        result = bulk.plan(self.manager, self.selection, bulk.MOVE, venue=self.annex)
+        # the second occurrence lands on the evening of Night 1
+        self.assertEqual([{earlier.name, later.name} for earlier, later in result.conflicts], [{'Weekly', 'Night 1'}])
+
+    def test_view_previews_then_applies(self):
+        self.client.login(username='manager', password='secret')
+        data = {'scope': 'selected', 'action': bulk.MOVE, 'venue': self.annex.pk,
+                'events': [event.pk for event in self.events]}
+        response = self.client.post('/bulk_events', {**data, 'preview': '1'})
+        self.assertContains(response, 'Apply to 3 events')
+        self.assertEqual(Event.objects.filter(venue=self.annex).count(), 0)
+        response = self.client.post('/bulk_events', {**data, 'apply': '1'})
+        self.assertRedirects(response, '/bulk_events')
+        self.assertEqual(Event.objects.filter(venue=self.annex).count(), 3)
+
+
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **extra):
+        return self.client.post('/search_venues', {'searched': 'Hall'}, **extra)
+
+    def use_up_tokens(self):
+        tokens, _ = throttling.parse_rate(throttling.THROTTLE_RATES['search'])
+        return [self.search().status_code for _ in range(tokens)]
+
+    def test_empty_bucket_gets_429_with_retry_after(self):
+        self.assertEqual(set(self.use_up_tokens()), {200})
+        response = self.search()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_each_client_has_its_own_bucket(self):
+        self.use_up_tokens()
+        self.assertEqual(self.search().status_code, 429)
+        self.assertEqual(self.search(REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_only_posts_to_search_are_throttled(self):
+        self.use_up_tokens()
+        self.assertEqual(self.client.get('/search_venues').status_code, 200)
+        self.assertEqual(self.search().status_code, 429)
+
+    def saturate(self):
+        # requests that started in the previous period and are still running
+        period = int(time.time() // throttling.IN_FLIGHT_PERIOD)
+        key = throttling._in_flight_key(period - 1)
+        cache.set(key, throttling.MAX_CONCURRENT, None)
+        return key
+
+    def test_saturated_site_sheds_with_503(self):
+        key = self.saturate()
+        with mock.patch.object(throttling, 'LATENCY_TARGET', 0.1):
+            response = self.search()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(cache.get(key), throttling.MAX_CONCURRENT)
+
+    def test_waits_for_a_slot_to_free(self):
+        key = self.saturate()
+        with mock.patch.object(throttling.time, 'sleep', side_effect=lambda _: cache.decr(key)):
+            self.assertEqual(self.search().status_code, 200)
+        self.assertEqual(cache.get(key), throttling.MAX_CONCURRENT - 1)
+
+    def test_long_expected_wait_is_shed_at_once(self):
+        self.saturate()
+        cache.set(throttling.DURATION_KEY, 60.0, None)
+        with mock.patch.object(throttling.time, 'sleep') as sleep:
+            response = self.search()
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(sleep.called)
+
+    def test_slots_go_back_to_the_count_they_were_taken_from(self):
+        # the first request started in the previous period, the second in this one
+        period = int(time.time() // throttling.IN_FLIGHT_PERIOD)
+        with mock.patch.object(throttling.time, 'time', return_value=(period - 1) * throttling.IN_FLIGHT_PERIOD):
+            first, _ = throttling._enter()
+        second, in_flight = throttling._take_slot()
+        self.assertEqual(in_flight, 2)
+        throttling._leave(first)
+        self.assertEqual((cache.get(first), cache.get(second)), (0, 1))
+        # a count culled and recreated under a running request does not go negative
+        cache.set(second, 0)
+        throttling._leave(second)
+        self.assertEqual(cache.get(second), 0)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hall = Venue.objects.create(name='Hall', address='1 Main St')
+        self.event = Event.objects.create(name='Club night', venue=self.hall,
+                                          event_date=timezone.make_aware(datetime(2030, 5, 1, 19)))
+
+    def get(self, path='/events'):
+        return self.client.get(path)
+
+    def rename(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.name = name
+            self.event.save()
+
+    def test_second_visit_is_a_hit(self):
+        self.assertEqual(self.get()['X-Page-Cache'], 'MISS')
+        response = self.get()
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertContains(response, 'Club night')
+
+    def test_saving_an_event_purges_its_pages(self):
+        self.get()
+        self.rename('Quiz night')
+        response = self.get()
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'Quiz night')
+        self.assertEqual(pagecache.stats()['stale'], 1)
+
+    def test_evicted_tags_do_not_revive_old_pages(self):
+        self.get()
+        self.rename('Quiz night')
+        cache.delete(pagecache._tag_key('events'))  # evicted
+        self.get('/')  # recreates the tag
+        response = self.get()
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'Quiz night')
+        self.assertNotContains(response, 'Club night')
+
+    def test_logged_in_visitors_bypass_the_cache(self):
+        User.objects.create_user('member', password='secret')
+        self.client.login(username='member', password='secret')
+        self.get()
+        self.assertNotIn('X-Page-Cache', self.get())
@@ -0,0 +1,182 @@
+"""Per-client throttling and load shedding for the expensive endpoints.
+
+``throttle`` gives every client (the logged-in user, otherwise the IP
+address) a token bucket per endpoint class: ``'30/m'`` holds 30 tokens and
+refills them over a minute, and each request takes one.  The buckets live in
+the shared cache and only use ``add``/``incr``, which are atomic there, so all
+workers draw from the same bucket: the tokens taken are counted per period,
+and the count of the previous period drains linearly over the current one.
+A client with an empty bucket gets 429 Too Many Requests.
+
+All throttled views also share one count of requests in flight, and at most
+``THROTTLE_MAX_CONCURRENT`` of them run at once.  A request arriving past that
+polls the count until a slot frees, for up to ``THROTTLE_LATENCY_TARGET``
+seconds; when the expected wait (from the recent average duration of these
+requests) is already longer, or no slot frees in time, it is shed with 503
+Service Unavailable.  Both responses carry ``Retry-After``.
+
+Rates are set per endpoint class in ``THROTTLE_RATES``; an entry named after
+a view, or the ``rate`` argument of the decorator, gives that view a bucket
+of its own.  ``methods`` limits the throttle to some HTTP methods, so a view
+can serve its empty form freely and only count the expensive submissions.
+"""
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+THROTTLE_RATES = {
+    'search': '30/m',
+    'export': '6/m',
+    **getattr(settings, 'THROTTLE_RATES', {}),
+}
+MAX_CONCURRENT = getattr(settings, 'THROTTLE_MAX_CONCURRENT', 8)
+LATENCY_TARGET = getattr(settings, 'THROTTLE_LATENCY_TARGET', 2.0)
+# reverse proxies in front of the site; their X-Forwarded-For entries are trusted
+PROXY_COUNT = getattr(settings, 'THROTTLE_PROXY_COUNT', 0)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+IN_FLIGHT_KEY = 'throttle:in_flight'
+DURATION_KEY = 'throttle:duration'
+# requests are counted under the period they started in and give their slot
+# back to that count only, so an expiring count never takes running requests
+# below zero; a slot leaked by a worker killed mid-request is forgotten with
+# its count, at most two periods later
+IN_FLIGHT_PERIOD = 5 * 60
+# weight of the latest request in the average duration
+DURATION_WEIGHT = 0.2
+# how often a request waiting for a slot looks at the count again
+POLL_INTERVAL = 0.05
+
+
+def parse_rate(rate):
+    """parse_rate(rate): Converts ``'<tokens>/<s|m|h|d>'`` into ``(tokens, period in seconds)``."""
+    tokens, period = rate.split('/')
+    return int(tokens), PERIODS[period.strip()[0]]
+
+
+def client_id(request):
+    """client_id(request): The user for logged-in requests, otherwise the client's IP address."""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    address = request.META.get('REMOTE_ADDR', '')
+    if PROXY_COUNT:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if forwarded:
+            address = forwarded[-min(PROXY_COUNT, len(forwarded))]
+    return f'ip:{address}'
+
+
+def _incr(key, timeout):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout)
+        return cache.incr(key)
+
+
+def take_token(bucket, rate):
+    """take_token(bucket, rate): Takes a token from ``bucket``.  Returns 0 when one was left,
+    otherwise the seconds until the bucket has refilled enough."""
+    tokens, period = parse_rate(rate)
+    now = time.time()
+    window, elapsed = divmod(now, period)
+    used = _incr(f'throttle:{bucket}:{int(window)}', period * 2)
+    previous = cache.get(f'throttle:{bucket}:{int(window) - 1}', 0)
+    remaining = period - elapsed
+    level = previous * remaining / period + used
+    if level <= tokens:
+        return 0
+    if used <= tokens:
+        # the previous period's tokens are still draining
+        wait = (level - tokens) * period / previous
+    else:
+        # this period alone is over the limit: wait for it to drain in the next one
+        wait = remaining + period * (1 - tokens / used)
+    return max(1, math.ceil(wait))
+
+
+def _in_flight_key(period):
+    return f'{IN_FLIGHT_KEY}:{period}'
+
+
+def _take_slot():
+    # returns the count the slot was taken from and the requests now in flight
+    period = int(time.time() // IN_FLIGHT_PERIOD)
+    slot = _in_flight_key(period)
+    taken = _incr(slot, IN_FLIGHT_PERIOD * 2)
+    return slot, taken + max(cache.get(_in_flight_key(period - 1), 0), 0)
+
+
+def _enter():
+    """_enter(): Takes a slot, waiting up to ``LATENCY_TARGET`` for one to free.  Returns
+    ``(slot, 0)`` once admitted, to be given back with ``_leave(slot)``, otherwise
+    ``(None, seconds to retry after)``."""
+    deadline = time.monotonic() + LATENCY_TARGET
+    while True:
+        slot, in_flight = _take_slot()
+        if in_flight <= MAX_CONCURRENT:
+            return slot, 0
+        _leave(slot)
+        duration = cache.get(DURATION_KEY, 0.0)
+        wait = (in_flight - MAX_CONCURRENT) * duration / MAX_CONCURRENT
+        if wait > LATENCY_TARGET or time.monotonic() + POLL_INTERVAL > deadline:
+            return None, max(1, math.ceil(wait))
+        time.sleep(POLL_INTERVAL)
+
+
+def _leave(slot):
+    try:
+        if cache.decr(slot) < 0:
+            # culled and recreated while the request ran: this slot is not in it
+            cache.incr(slot)
+    except ValueError:
+        pass  # expired while the request ran
+
+
+def _record_duration(seconds):
+    # last writer wins; the average only has to be roughly right
+    average = cache.get(DURATION_KEY)
+    if average is not None:
+        seconds = average + DURATION_WEIGHT * (seconds - average)
+    cache.set(DURATION_KEY, seconds, None)
+
+
+def _refuse(status, message, retry_after):
+    response = HttpResponse(message, status=status, content_type='text/plain')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def throttle(endpoint_class, rate=None, methods=None):
+    """Decorator limiting how often each client may call a view of ``endpoint_class``, and shedding
+    load when too many throttled requests are already running.  With ``methods``, requests using
+    other HTTP methods pass straight through."""
+    def decorator(view):
+        if rate is not None or view.__name__ in THROTTLE_RATES:
+            bucket_name, view_rate = f'{endpoint_class}:{view.__name__}', rate or THROTTLE_RATES[view.__name__]
+        else:
+            bucket_name, view_rate = endpoint_class, THROTTLE_RATES[endpoint_class]
+
+        @wraps(view)
+        def _wrapped_view(request, *args, **kwargs):
+            if methods is not None and request.method not in methods:
+                return view(request, *args, **kwargs)
+            retry_after = take_token(f'{bucket_name}:{client_id(request)}', view_rate)
+            if retry_after:
+                return _refuse(429, 'Too many requests, please try again later.', retry_after)
+            slot, retry_after = _enter()
+            if retry_after:
+                return _refuse(503, 'The site is busy, please try again shortly.', retry_after)
+            started = time.monotonic()
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _leave(slot)
+                _record_duration(time.monotonic() - started)
+        return _wrapped_view
+    return decorator
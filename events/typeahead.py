@@ -0,0 +1,210 @@
+"""In-process prefix index for venue and event name typeahead.
+
+Names are normalised (case and accents folded) and every word start of a name
+is kept in one sorted list, so a lookup is a ``bisect`` plus a short scan.
+The index is built on first use and then kept current without rescanning the
+tables:
+
+* saves and deletes append an operation to a change log in the shared cache
+  under an atomically incremented version number, and apply it locally;
+* other workers compare their version with the shared one at most every
+  ``SYNC_INTERVAL`` seconds and replay the operations they missed;
+* a snapshot of the whole index is stored under its version every
+  ``SNAPSHOT_EVERY`` operations, so a starting (or badly lagging) worker loads
+  it instead of scanning the tables.
+"""
+import pickle
+import threading
+import time
+import unicodedata
+import zlib
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'typeahead:version'
+SNAPSHOT_KEY = 'typeahead:snapshot'
+SYNC_INTERVAL = getattr(settings, 'TYPEAHEAD_SYNC_INTERVAL', 2.0)
+SNAPSHOT_EVERY = 200
+OP_TIMEOUT = 24 * 60 * 60
+
+VENUE = 'venue'
+EVENT = 'event'
+
+
+def normalise(text):
+    """normalise(text): Case- and accent-folds ``text`` and collapses its whitespace."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def _word_starts(name):
+    words = normalise(name).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+    """Sorted ``keys`` with a parallel ``entries`` list of ``(kind, pk, name)``."""
+
+    def __init__(self, keys=None, entries=None, version=0):
+        self.keys = keys or []
+        self.entries = entries or []
+        self.version = version
+        self.names = {}
+        for entry in self.entries:
+            self.names[entry[:2]] = entry[2]
+
+    @classmethod
+    def build(cls, items, version=0):
+        pairs = sorted(
+            (f'{start}\x00{kind}:{pk}', (kind, pk, name))
+            for kind, pk, name in items for start in _word_starts(name)
+        )
+        return cls([key for key, _ in pairs], [entry for _, entry in pairs], version)
+
+    def items(self):
+        return [(kind, pk, name) for (kind, pk), name in self.names.items()]
+
+    def __len__(self):
+        return len(self.names)
+
+    def remove(self, kind, pk):
+        name = self.names.pop((kind, pk), None)
+        if name is None:
+            return
+        for start in _word_starts(name):
+            key = f'{start}\x00{kind}:{pk}'
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+                del self.entries[i]
+
+    def add(self, kind, pk, name):
+        self.remove(kind, pk)
+        self.names[(kind, pk)] = name
+        for start in _word_starts(name):
+            key = f'{start}\x00{kind}:{pk}'
+            i = bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.entries.insert(i, (kind, pk, name))
+
+    def apply(self, op):
+        if op[0] == 'set':
+            self.add(*op[1:])
+        else:
+            self.remove(*op[1:])
+
+    def search(self, prefix, limit=10, kind=None):
+        """Returns up to ``limit`` ``(kind, pk, name)`` entries with a word starting with ``prefix``."""
+        prefix = normalise(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit and self.keys[i].startswith(prefix):
+            entry = self.entries[i]
+            if entry[:2] not in seen and (kind is None or entry[0] == kind):
+                seen.add(entry[:2])
+                results.append(entry)
+            i += 1
+        return results
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'checked': 0.0}
+
+
+def _load_from_database():
+    from .models import Event, Venue
+    items = [(VENUE, pk, name) for pk, name in Venue.objects.values_list('pk', 'name').iterator()]
+    items += [(EVENT, pk, name) for pk, name in Event.objects.values_list('pk', 'name').iterator()]
+    return items
+
+
+def _op_key(version):
+    return f'typeahead:op:{version}'
+
+
+def _publish_snapshot(index):
+    # only the names are stored, compressed, to stay within the item size
+    # limits of memcached-style backends; sorting them back is cheap
+    data = zlib.compress(pickle.dumps(index.items(), pickle.HIGHEST_PROTOCOL))
+    cache.set(SNAPSHOT_KEY, (index.version, data), None)
+
+
+def _reload(version):
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is not None and snapshot[0] <= version:
+        index = PrefixIndex.build(pickle.loads(zlib.decompress(snapshot[1])), snapshot[0])
+        if _catch_up(index, version):
+            return index
+    # no usable snapshot: this worker pays for one table scan and shares it
+    cache.add(VERSION_KEY, 0, None)
+    version = cache.get(VERSION_KEY, 0)
+    index = PrefixIndex.build(_load_from_database(), version)
+    _publish_snapshot(index)
+    return index
+
+
+def _catch_up(index, version):
+    """Replays the logged operations up to ``version``; False if one has been evicted."""
+    if version <= index.version:
+        return True
+    ops = cache.get_many([_op_key(v) for v in range(index.version + 1, version + 1)])
+    for v in range(index.version + 1, version + 1):
+        op = ops.get(_op_key(v))
+        if op is None:
+            return False
+        index.apply(op)
+        index.version = v
+    return True
+
+
+def get_index():
+    """get_index(): Returns this worker's index, building or syncing it when due."""
+    with _lock:
+        index = _state['index']
+        now = time.monotonic()
+        if index is not None and now - _state['checked'] < SYNC_INTERVAL:
+            return index
+        _state['checked'] = now
+        version = cache.get(VERSION_KEY)
+        if index is None or version is None or version < index.version:
+            # first use, or the shared cache was flushed
+            index = _reload(version or 0)
+        elif version > index.version and not _catch_up(index, version):
+            index = _reload(version)
+        _state['index'] = index
+        return index
+
+
+def record(op):
+    """record(op): Logs an index change for every worker and applies it to this one."""
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # the shared state is gone; rebuild from the tables on the next lookup
+        with _lock:
+            _state['checked'] = 0.0
+        return
+    cache.set(_op_key(version), op, OP_TIMEOUT)
+    with _lock:
+        index = _state['index']
+        if index is None:
+            return
+        if index.version == version - 1:
+            index.apply(op)
+            index.version = version
+            if version % SNAPSHOT_EVERY == 0:
+                _publish_snapshot(index)
+        else:
+            # other workers wrote in between; replay in order on the next lookup
+            _state['checked'] = 0.0
+
+
+def search(prefix, limit=10, kind=None):
+    """search(prefix, limit, kind): Looks ``prefix`` up in the shared-synced index."""
+    return get_index().search(prefix, limit, kind)
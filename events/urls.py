@@ -5,9 +5,12 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('<int:year>/<str:month>/', views.home, name='home'),
     path('events', views.all_events, name='events_list'),
+    path('events/history', views.events_history, name='events-history'),
     path('add_venue', views.add_venue, name='add-venue'),
     path('list_venues', views.list_venues, name='list-venues'),
     path('show_venue/<venue_id>', views.show_venue, name='show-venue'),
+    path('show_event/<int:event_id>', views.show_event, name='show-event'),
+    path('venues_near', views.venues_near, name='venues-near'),
     path('search_venues', views.search_venues, name='search-venues'),
     path('update_venue/<venue_id>', views.update_venue, name='update-venue'),
     path('update_event/<event_id>', views.update_event, name='update-event'),
@@ -18,5 +21,13 @@ urlpatterns = [
     path('venue_csv', views.venue_csv, name='venue_csv'),
     path('venue_pdf', views.venue_pdf, name='venue_pdf'),
     path('my_events', views.my_events, name='my_events'),
+    path('bulk_events', views.bulk_events, name='bulk-events'),
     path('search_events', views.search_events, name='search_events'),
+    path('typeahead', views.typeahead, name='typeahead'),
+    path('sitemap.xml', views.sitemap_index, name='sitemap-index'),
+    path('sitemap-<str:section>-<int:number>.xml', views.sitemap_section, name='sitemap-section'),
+    path('robots.txt', views.robots_txt, name='robots-txt'),
+    path('venue_stats', views.venue_stats, name='venue-stats'),
+    path('venue_stats_csv', views.venue_stats_csv, name='venue-stats-csv'),
+    path('page_cache_stats', views.page_cache_stats, name='page-cache-stats'),
 ]
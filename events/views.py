@@ -1,11 +1,12 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
 import calendar
-from calendar import HTMLCalendar
-from datetime import datetime
+from datetime import date, datetime
 from django.http import HttpResponseRedirect
-from .models import Event, Venue
-from .forms import VenueForm, EventForm, EventFormAdmin
-from django.http import HttpResponse
+from .models import ArchivedEvent, Event, Venue, VenueMonthlyStats
+from .forms import BulkEventForm, VenueForm, EventForm, EventFormAdmin
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import last_modified
 import csv
 from django.contrib.auth.models import User
 from django.http import FileResponse
@@ -15,10 +16,23 @@ from reportlab.lib.units import inch
 from reportlab.lib.pagesizes import letter
 from django.core.paginator import Paginator
 from django.contrib import messages
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import IntegrityError, transaction
+from .calendars import EventCalendar
+from . import recurrence as rrule
+from .stats import month_bounds
+from .pagecache import add_surrogate_keys, anonymous_last_modified, cache_anonymous_page, event_key, venue_key
+from . import pagecache
+from . import geo
+from . import typeahead as prefix_index
+from . import sitemaps
+from . import bulk
+from .throttling import throttle
 
 
 # Create your views here.
 # generate pdf views
+@throttle('export')
 def venue_pdf(request):
     """venue_pdf(request): Generates a PDF document containing a list of venues."""
     buf = io.BytesIO()
@@ -48,6 +62,7 @@ def venue_pdf(request):
         return FileResponse(buf, as_attachment=True, filename='venue.pdf')
 
 
+@throttle('export')
 def venue_csv(request):
     """venue_csv(request): Generates a CSV file containing venue details."""
     response = HttpResponse(content_type='text/csv')
@@ -66,6 +81,7 @@ def venue_csv(request):
 
 
 # generate text file list
+@throttle('export')
 def venue_text(request):
     """venue_text(request): Generates a plain text file containing venue details."""
     response = HttpResponse(content_type='text/plain')
@@ -81,6 +97,47 @@ def venue_text(request):
     return response
 
 
+def _venue_stats_queryset(request):
+    """Filters the monthly rollup on the optional ``year`` and ``venue`` query parameters."""
+    stats = VenueMonthlyStats.objects.select_related('venue')
+    year = request.GET.get('year')
+    venue = request.GET.get('venue')
+    if year and year.isdigit():
+        stats = stats.filter(month__year=int(year))
+    if venue and venue.isdigit():
+        stats = stats.filter(venue_id=int(venue))
+    return stats
+
+
+def venue_stats(request):
+    """venue_stats(request): Displays events, attendees and managers per venue per month,
+    read from the monthly rollup only."""
+    if not request.user.is_staff:
+        messages.success(request, "You are not able to view this page!")
+        return redirect('home')
+
+    p = Paginator(_venue_stats_queryset(request), 25)
+    stats = p.get_page(request.GET.get('page'))
+    return render(request, 'events/venue_stats.html',
+                  {'stats': stats, 'year': request.GET.get('year', ''), 'venue': request.GET.get('venue', '')})
+
+
+def venue_stats_csv(request):
+    """venue_stats_csv(request): Exports the venue monthly rollup as a CSV file."""
+    if not request.user.is_staff:
+        messages.success(request, "You are not able to view this page!")
+        return redirect('home')
+
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=venue_stats.csv'
+    writer = csv.writer(response)
+    writer.writerow(['Venue', 'Month', 'Events', 'Distinct attendees', 'Distinct managers'])
+    for row in _venue_stats_queryset(request).iterator(chunk_size=2000):
+        writer.writerow([row.venue.name, row.month.strftime('%Y-%m'), row.event_count,
+                         row.attendee_count, row.manager_count])
+    return response
+
+
 def add_venue(request):
     """add_venue(request): Handles the addition of a new venue to the system."""
     submitted = False
@@ -100,23 +157,37 @@ def add_venue(request):
     return render(request, 'events/add_venue.html', {'form': form, 'submitted': submitted})
 
 
+def _save_booking(form, event=None):
+    """Saves an event form, returning False when the database rejects the booking because
+    the venue was booked for an overlapping time in the meantime."""
+    try:
+        with transaction.atomic():
+            if event is None:
+                form.save()
+            else:
+                event.save()
+    except IntegrityError:
+        form.add_error(None, 'This venue has just been booked for an overlapping time.')
+        return False
+    return True
+
+
 def add_event(request):
     """add_event(request): Handles the addition of a new event to the system."""
     submitted = False
     if request.method == "POST":
         if request.user.is_superuser:
             form = EventFormAdmin(request.POST)
-            if form.is_valid():
-                form.save()
+            if form.is_valid() and _save_booking(form):
                 return HttpResponseRedirect('/add_event?submitted=True')
         else:
             form = EventForm(request.POST)
             if form.is_valid():
                 event = form.save(commit=False)
                 event.manager = request.user  # logged in user
-                event.save()
-                # form.save()
-                return HttpResponseRedirect('/add_event?submitted=True')
+                if _save_booking(form, event):
+                    # form.save()
+                    return HttpResponseRedirect('/add_event?submitted=True')
     else:
         if request.user.is_superuser:
             form = EventFormAdmin
@@ -129,6 +200,7 @@ def add_event(request):
     return render(request, 'events/add_event.html', {'form': form, 'submitted': submitted})
 
 
+@cache_anonymous_page()
 def list_venues(request):
     """list_venues(request): Retrieves and displays a list of venues."""
     venue_list = Venue.objects.all()
@@ -137,17 +209,70 @@ def list_venues(request):
     page = request.GET.get('page')
     venues = p.get_page(page)
 
-    return render(request, 'events/venues.html',
-                  {'venue_list': venue_list, 'venues': venues}
-                  )
+    response = render(request, 'events/venues.html',
+                      {'venue_list': venue_list, 'venues': venues}
+                      )
+    return add_surrogate_keys(response, 'venues', *(venue_key(venue.pk) for venue in venues))
 
 
+def _float_param(request, name, default=None):
+    try:
+        return float(request.GET.get(name, default))
+    except (TypeError, ValueError):
+        return None
+
+
+def venues_near(request):
+    """venues_near(request): Lists the venues closest to the given latitude and longitude."""
+    latitude = _float_param(request, 'lat')
+    longitude = _float_param(request, 'lon')
+    radius = _float_param(request, 'radius', 10)
+    results = None
+    if latitude is not None and longitude is not None and radius is not None:
+        if -90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius <= 500:
+            results = geo.nearest(Venue.objects.all(), latitude, longitude, radius)
+        else:
+            messages.success(request, "Please enter a valid location and a radius of up to 500 km.")
+
+    return render(request, 'events/venues_near.html',
+                  {'results': results, 'lat': request.GET.get('lat', ''), 'lon': request.GET.get('lon', ''),
+                   'radius': request.GET.get('radius', 10)})
+
+
+def _venue_updated(request, venue_id):
+    return Venue.objects.filter(pk=venue_id).values_list('updated', flat=True).first()
+
+
+def _event_updated(request, event_id):
+    return Event.objects.filter(pk=event_id).values_list('updated', flat=True).first()
+
+
+@anonymous_last_modified(_venue_updated)
+@cache_anonymous_page()
 def show_venue(request, venue_id):
     """show_venue(request, venue_id): Retrieves and displays details of a specific venue."""
-    venue = Venue.objects.get(pk=venue_id)
+    venue = get_object_or_404(Venue, pk=venue_id)
     venue_owner = User.objects.get(pk=venue.owner)
-    return render(request, 'events/show_venue.html',
-                  {'venue': venue, 'venue_owner': venue_owner})
+    response = render(request, 'events/show_venue.html',
+                      {'venue': venue, 'venue_owner': venue_owner})
+    return add_surrogate_keys(response, venue_key(venue.pk))
+
+
+@anonymous_last_modified(_event_updated)
+@cache_anonymous_page()
+def show_event(request, event_id):
+    """show_event(request, event_id): Retrieves and displays details of a specific event."""
+    event = Event.objects.select_related('venue', 'manager').filter(pk=event_id).first()
+    if event is None:
+        # archived events stay reachable from the sitemap and typeahead the crawler saw
+        if ArchivedEvent.objects.filter(pk=event_id).exists():
+            return redirect('events-history')
+        raise Http404('No such event')
+    response = render(request, 'events/show_event.html', {'event': event})
+    keys = [event_key(event.pk)]
+    if event.venue_id:
+        keys.append(venue_key(event.venue_id))
+    return add_surrogate_keys(response, *keys)
 
 
 def update_venue(request, venue_id):
@@ -169,8 +294,7 @@ def update_event(request, event_id):
     else:
         form = EventForm(request.POST or None, instance=event)
 
-    if form.is_valid():
-        form.save()
+    if form.is_valid() and _save_booking(form):
         return redirect('events_list')
     return render(request, 'events/update_event.html',
                   {'event': event, 'form': form})
@@ -210,6 +334,46 @@ def my_events(request):
         return redirect('home')
 
 
+def bulk_events(request):
+    """bulk_events(request): Moves, shifts or deletes many of the current user's events at once,
+    showing the affected rows first."""
+    if not request.user.is_authenticated:
+        messages.success(request, "You are not able to view this page!")
+        return redirect('home')
+
+    form = BulkEventForm(request.POST or None)
+    preview = None
+    if request.method == "POST" and form.is_valid():
+        if form.cleaned_data['scope'] == BulkEventForm.PAST:
+            selection = bulk.past_events(request.user)
+        else:
+            selection = Event.objects.filter(pk__in=form.cleaned_data['events'])
+        action = form.cleaned_data['action']
+        try:
+            if 'apply' in request.POST:
+                result = bulk.apply(request.user, selection, action, **form.options())
+                messages.success(request, f"{len(result)} events changed.")
+                return redirect('bulk-events')
+            preview = bulk.plan(request.user, selection, action, **form.options())
+        except PermissionDenied as error:
+            form.add_error(None, str(error))
+        except ValidationError as error:
+            form.add_error(None, error)
+        except IntegrityError:
+            form.add_error(None, 'A venue has just been booked for an overlapping time.')
+
+    selected = set(form.cleaned_data.get('events', [])) if form.is_bound and form.is_valid() else set()
+    events = bulk.managed_by(request.user).select_related('venue').order_by('event_date')
+    return render(request, 'events/bulk_events.html', {
+        'form': form,
+        'events': events,
+        'selected': selected,
+        'preview': preview,
+        'preview_rows': bulk.preview(preview) if preview else [],
+    })
+
+
+@throttle('search', methods=('POST',))
 def search_venues(request):
     """search_venues(request): Searches for venues based on user input."""
     if request.method == 'POST':
@@ -221,6 +385,7 @@ def search_venues(request):
         return render(request, 'events/search_venues.html', {})
 
 
+@throttle('search', methods=('POST',))
 def search_events(request):
     """search_events(request): Searches for events based on user input."""
     if request.method == 'POST':
@@ -232,13 +397,47 @@ def search_events(request):
         return render(request, 'events/search_events.html', {})
 
 
+def typeahead(request):
+    """typeahead(request): Returns venue and event names starting with ``q`` as JSON."""
+    kind = request.GET.get('kind')
+    if kind not in (prefix_index.VENUE, prefix_index.EVENT):
+        kind = None
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        limit = 10
+    results = [
+        {'kind': entry_kind, 'id': pk, 'name': name,
+         'url': reverse('show-venue' if entry_kind == prefix_index.VENUE else 'show-event', args=[pk])}
+        for entry_kind, pk, name in prefix_index.search(request.GET.get('q', ''), limit, kind)
+    ]
+    return JsonResponse({'results': results})
+
+
+def events_history(request):
+    """events_history(request): Displays archived past events, most recent first."""
+    archived = (ArchivedEvent.objects.select_related('venue', 'manager')
+                .prefetch_related('attendees').order_by('-event_date'))
+    p = Paginator(archived, 20)
+    events = p.get_page(request.GET.get('page'))
+    return render(request, 'events/events_history.html', {'events': events})
+
+
+@cache_anonymous_page()
 def all_events(request):
     """all_events(request): Retrieves and displays a list of all events."""
-    events_list = Event.objects.all().order_by('name')
-    return render(request, 'events/events_list.html',
-                  {'events_list': events_list})
-
-
+    events_list = list(Event.objects.select_related('venue', 'manager').order_by('name'))
+    # series are shown once, with their next dates expanded on the fly
+    for event in events_list:
+        if event.is_recurring:
+            event.upcoming = rrule.next_occurrences(event, 5)
+    response = render(request, 'events/events_list.html',
+                      {'events_list': events_list})
+    venue_keys = {venue_key(event.venue_id) for event in events_list if event.venue_id}
+    return add_surrogate_keys(response, 'events', *venue_keys)
+
+
+@cache_anonymous_page()
 def home(request, year=datetime.now().year, month=datetime.now().strftime('%B')):
     """home(request, year, month): Renders the home page of the application with a calendar
     view of events for the specified year and month."""
@@ -253,20 +452,70 @@ def home(request, year=datetime.now().year, month=datetime.now().strftime('%B'))
     month_number = list(calendar.month_name).index(month)
     month_number = int(month_number)
 
-    # create calendar
-    cal = HTMLCalendar().formatmonth(
+    # create calendar, expanding recurring events for this month only
+    start, end = month_bounds(date(year, month_number, 1))
+    occurrences = rrule.occurrences_between(Event.objects.all(), start, end)
+    cal = EventCalendar(occurrences).formatmonth(
         year,
         month_number)
     # get current year
     now = datetime.now()
     current_year = now.year
-    return render(request,
-                  'events/home.html', {
-                    "name": name,
-                    "year": year,
-                    "month": month,
-                    "month_number": month_number,
-                    "cal": cal,
-                    "current_year": current_year,
-                    })
-
+    response = render(request,
+                      'events/home.html', {
+                        "name": name,
+                        "year": year,
+                        "month": month,
+                        "month_number": month_number,
+                        "cal": cal,
+                        "current_year": current_year,
+                        })
+    return add_surrogate_keys(response, 'events')
+
+
+def page_cache_stats(request):
+    """page_cache_stats(request): Returns the anonymous page cache counters as JSON."""
+    if not request.user.is_staff:
+        messages.success(request, "You are not able to view this page!")
+        return redirect('home')
+    return JsonResponse(pagecache.stats())
+
+
+def _site_url(request):
+    return f'{request.scheme}://{request.get_host()}'
+
+
+@last_modified(lambda request: sitemaps.last_modified())
+def sitemap_index(request):
+    """sitemap_index(request): Returns the sitemap index of the venue and event sitemaps."""
+    return HttpResponse(sitemaps.index_xml(_site_url(request)), content_type='application/xml')
+
+
+@last_modified(lambda request, section, number: sitemaps.last_modified(section, number))
+def sitemap_section(request, section, number):
+    """sitemap_section(request, section, number): Streams one sitemap file of venue or event URLs."""
+    if section not in sitemaps.SECTIONS:
+        raise Http404('No such sitemap')
+    content = sitemaps.section_xml(_site_url(request), section, number)
+    if content is None:
+        raise Http404('No such sitemap')
+    return StreamingHttpResponse(content, content_type='application/xml')
+
+
+def robots_txt(request):
+    """robots_txt(request): Points crawlers at the sitemap and away from searches, exports and deep pagination."""
+    lines = [
+        'User-agent: *',
+        'Disallow: /admin/',
+        'Disallow: /members/',
+        'Disallow: ' + reverse('list-venues') + '?',
+        'Disallow: ' + reverse('search-venues'),
+        'Disallow: ' + reverse('search_events'),
+        'Disallow: ' + reverse('typeahead'),
+        'Disallow: ' + reverse('venue_text'),
+        'Disallow: ' + reverse('venue_csv'),
+        'Disallow: ' + reverse('venue_pdf'),
+        '',
+        'Sitemap: ' + _site_url(request) + reverse('sitemap-index'),
+    ]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain')
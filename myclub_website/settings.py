@@ -95,6 +95,36 @@ DATABASES = {
      }
  }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The anonymous page cache keeps its pages, invalidation versions and counters
+# here; use a shared backend (Memcached, Redis) when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # pages, tag versions, throttle buckets and sitemaps share this cache;
+        # the default of 300 entries would keep culling them
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+PAGE_CACHE_TIMEOUT = 300
+
+# Per-client limits for the expensive views, '<requests>/<s|m|h|d>' per endpoint
+# class or per view name; see events/throttling.py
+THROTTLE_RATES = {
+    'search': '30/m',
+    'export': '6/m',
+}
+# throttled requests allowed to run at once, and the longest a request waits
+# for a free slot before it is turned away with a 503
+THROTTLE_MAX_CONCURRENT = 8
+THROTTLE_LATENCY_TARGET = 2.0
+
+# Range partition the archived events table by event date (PostgreSQL only)
+EVENT_ARCHIVE_PARTITIONED = False
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 